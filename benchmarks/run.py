@@ -0,0 +1,265 @@
+'''Benchmarks of `utils.py` and `plotting.py` on synthetic data.
+
+Run from the repository root, e.g.
+
+    python benchmarks/run.py --scales small medium --output results.json
+    python benchmarks/run.py --baseline results.json --threshold .25
+
+Everything is generated locally, no data needs to be downloaded.
+'''
+import argparse
+import collections
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('MAPPER_CACHE_DIR', tempfile.mkdtemp(prefix='bench-'))
+
+import matplotlib.cm  # noqa: E402
+
+import caching  # noqa: E402
+import synthetic  # noqa: E402
+import tracking  # noqa: E402
+import utils  # noqa: E402
+
+# number of counties and of Mapper nodes of each scale
+SCALES = collections.OrderedDict([
+    ('small', (3000, 1000)),
+    ('medium', (30000, 10000)),
+    ('large', (200000, 100000))])
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    '''Decorator registering a benchmark. The decorated function takes the
+    context of a scale and returns a function without arguments to time.'''
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def get_context(n_counties, n_nodes, seed=0):
+    '''Function to generate the synthetic inputs of a scale.'''
+
+    df = synthetic.get_synthetic_frame(n_counties, seed=seed)
+    df_year = df[df['year'] == 2016].reset_index(drop=True)
+    graph = synthetic.get_synthetic_graph(n_counties, n_nodes, seed=seed)
+    node_elements = graph['node_metadata']['node_elements']
+
+    node_ids = np.random.RandomState(seed).permutation(n_nodes)
+    regions = dict(enumerate(map(set, np.array_split(node_ids, 6))))
+
+    return {'df': df, 'df_year': df_year, 'graph': graph,
+            'node_elements': node_elements, 'regions': regions,
+            'n_electors': df_year['n_electors']}
+
+
+@benchmark('get_data')
+def bench_get_data(context):
+    df = context['df']
+    return lambda: utils.get_data(df.copy())
+
+
+@benchmark('get_node_summary')
+def bench_get_node_summary(context):
+    node_elements, values = (context['node_elements'],
+                             context['df_year']['Per capita personal income'])
+    return lambda: utils.get_node_summary(node_elements, values)
+
+
+@benchmark('get_node_summaries')
+def bench_get_node_summaries(context):
+    node_elements = context['node_elements']
+    values = context['df_year'][utils.get_cols_for_mapper()]
+    return lambda: utils.get_node_summaries(
+        node_elements, values, ['mean', 'median', 'std', .25, .75])
+
+
+@benchmark('get_n_electors')
+def bench_get_n_electors(context):
+    node_elements, n_electors = context['node_elements'], context['n_electors']
+    return lambda: utils.get_n_electors(node_elements, n_electors)
+
+
+@benchmark('get_county_plot_data')
+def bench_get_county_plot_data(context):
+    graph, df_year = context['graph'], context['df_year']
+    return lambda: utils.get_county_plot_data(
+        graph, df_year, 'Per capita personal income', matplotlib.cm.viridis)
+
+
+@benchmark('get_data_per_region')
+def bench_get_data_per_region(context):
+    regions, node_elements = context['regions'], context['node_elements']
+    return lambda: utils.get_data_per_region(regions, node_elements)
+
+
+@benchmark('get_flow_table')
+def bench_get_flow_table(context):
+    fips_by_year = tracking.get_fips_by_year(context['df'])
+    n_nodes = len(context['node_elements'])
+    node_elements_by_year = dict(
+        (year, synthetic.get_synthetic_node_elements(len(fips), n_nodes,
+                                                     seed=i))
+        for i, (year, fips) in enumerate(fips_by_year.items()))
+
+    def run():
+        memberships = tracking.get_county_memberships(node_elements_by_year,
+                                                      fips_by_year)
+        tracking.get_best_match_chains(tracking.get_overlaps(memberships))
+        return tracking.get_flow_table(memberships)
+    return run
+
+
+@benchmark('get_node_text')
+def bench_get_node_text(context):
+    node_elements = context['node_elements']
+    n_electors = utils.get_n_electors(node_elements, context['n_electors'])
+    node_color = utils.get_node_summary(node_elements,
+                                        context['df_year']['winner'])
+    return lambda: utils.get_node_text(dict(enumerate(node_elements)),
+                                       n_electors, node_color, 'label')
+
+
+def _get_cached_pipeline(graph, data):
+    # default Mapper pipeline whose graph of `data` is set to the synthetic
+    # graph in the graph cache, so that the plot benchmarks measure figure
+    # construction and not a Mapper fit
+    from gtda.mapper import make_mapper_pipeline
+
+    pipeline = make_mapper_pipeline()
+    caching.set_mapper_graph(pipeline, data, graph)
+    return pipeline
+
+
+@benchmark('get_graph_plot_colored_by_election_results')
+def bench_get_graph_plot(context):
+    import plotting
+
+    data = context['df_year'][utils.get_cols_for_mapper()].values
+    pipeline = _get_cached_pipeline(context['graph'], data)
+    election_data = utils.get_election_data(context['df'])
+    return lambda: plotting.get_graph_plot_colored_by_election_results(
+        pipeline, 2016, election_data, data, None)
+
+
+@benchmark('get_graph_plot_compact_to_json')
+def bench_get_graph_plot_compact(context):
+    import plotting
+
+    data = context['df_year'][utils.get_cols_for_mapper()].values
+    pipeline = _get_cached_pipeline(context['graph'], data)
+    election_data = utils.get_election_data(context['df'])
+    return lambda: plotting.get_graph_plot_colored_by_election_results(
+        pipeline, 2016, election_data, data, None, compact=True).to_json()
+
+
+@benchmark('get_region_plot')
+def bench_get_region_plot(context):
+    import graph_layout
+    import plotting
+
+    data = context['df_year'][utils.get_cols_for_mapper()].values
+    pipeline = _get_cached_pipeline(context['graph'], data)
+    layout = graph_layout.get_graph_layout(context['graph'])
+    colorscale = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                  '#8c564b']
+    return lambda: plotting.get_region_plot(
+        pipeline, data, layout, context['node_elements'], colorscale,
+        context['regions'])
+
+
+def run_benchmark(func, repeat):
+    '''Function to measure the best wall time over `repeat` runs of `func`
+    and its peak memory allocation (measured on a separate run, as tracing
+    allocations slows the code down).'''
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time': min(times), 'peak_memory': peak}
+
+
+def compare(results, baseline, threshold):
+    '''Function to list the benchmarks slower or using more memory than in
+    the baseline by more than `threshold` (relative), and those raising an
+    error that ran in the baseline.'''
+
+    regressions = []
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            reference = baseline.get(scale, {}).get(name)
+            if reference is None or 'error' in reference:
+                continue
+            if 'error' in result:
+                regressions.append(f'{scale}/{name}: {result["error"]}')
+                continue
+            for metric in ['time', 'peak_memory']:
+                ratio = result[metric] / max(reference[metric], 1e-12)
+                if ratio > 1 + threshold:
+                    regressions.append(f'{scale}/{name}: {metric} x'
+                                       f'{ratio:.2f}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', default=['small'],
+                        choices=list(SCALES))
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON file of earlier results')
+    parser.add_argument('--threshold', type=float, default=.25,
+                        help='relative slowdown counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = collections.OrderedDict()
+    for scale in args.scales:
+        context = get_context(*SCALES[scale])
+        results[scale] = collections.OrderedDict()
+        for name in args.benchmarks:
+            try:
+                result = run_benchmark(BENCHMARKS[name](context), args.repeat)
+            except Exception as e:
+                result = {'error': f'{type(e).__name__}: {e}'}
+            results[scale][name] = result
+            print(f'{scale:>8} {name:<45}' +
+                  (f'{result["time"]:10.4f} s {result["peak_memory"] / 2**20:10.1f} MiB'
+                   if 'error' not in result else f' {result["error"]}'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        print('\n'.join(['Regressions:'] + regressions) if regressions
+              else 'No regression.')
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+import utils
+
+STATES = ['AL', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'ID', 'IL',
+          'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS',
+          'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH',
+          'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA',
+          'WA', 'WV', 'WI', 'WY']
+
+
+def get_synthetic_frame(n_counties=3000, years=(2000, 2004, 2008, 2012, 2016),
+                        seed=0):
+    '''Function to generate a data frame with the columns of the BEA/MEDSL
+    county panel (see `utils.get_cols_by_type`), one row per county and
+    election year, sorted by year and FIPS code.
+
+    Parameters
+    ----------
+    n_counties : int (default: 3000)
+        Number of counties
+    years : tuple (default: (2000, 2004, 2008, 2012, 2016))
+        Election years
+    seed : int (default: 0)
+        Seed of the random values
+
+    Returns
+    -------
+    df : pandas data frame
+    '''
+
+    rng = np.random.RandomState(seed)
+    num_cols, info_cols, elec_cols = utils.get_cols_by_type()
+    n_rows = n_counties * len(years)
+
+    # economic values are log-normal around a county level, with a few
+    # negative values as in the income columns of the real data
+    county_level = rng.normal(0, 1, (n_counties, 1))
+    values = np.exp(np.tile(county_level, (len(years), 1)) +
+                    rng.normal(8, 1, (n_rows, len(num_cols))))
+    values[rng.rand(n_rows, len(num_cols)) < .001] *= -.01
+    df = pd.DataFrame(values, columns=num_cols)
+
+    fips = np.sort(rng.choice(np.arange(1001, 57000), n_counties,
+                              replace=n_counties > 55999))
+    state_idx = np.searchsorted(np.linspace(1000, 57000, len(STATES) + 1),
+                                fips) - 1
+    df['year'] = np.repeat(years, n_counties)
+    df['state'] = np.tile(np.array(STATES)[state_idx], len(years))
+    df['county'] = np.tile([f'County {f}' for f in fips], len(years))
+    df['fips'] = np.tile(fips, len(years))
+    df['pres'] = 'president'
+
+    total_votes = rng.randint(1000, 1000000, n_rows)
+    republican = (total_votes * rng.uniform(.2, .8, n_rows)).astype(int)
+    df['republican'] = republican
+    df['democrat'] = total_votes - republican
+    df['total_votes'] = total_votes
+    df['n_electors'] = total_votes / total_votes.sum() * 538 * len(years)
+    df['winner'] = (2 * republican > total_votes).astype(int)
+
+    return df[num_cols + info_cols + elec_cols]
+
+
+def get_synthetic_node_elements(n_samples, n_nodes, mean_size=20, seed=0):
+    '''Function to generate Mapper node memberships: every node contains a
+    run of consecutive points of a random permutation of the data points, so
+    that nodes overlap as in a Mapper cover.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of data points
+    n_nodes : int
+        Number of nodes
+    mean_size : int (default: 20)
+        Mean number of data points per node
+    seed : int (default: 0)
+        Seed of the memberships
+
+    Returns
+    -------
+    node_elements : tuple
+        Tuple of arrays where array at position x contains the data points
+        for node x
+    '''
+
+    rng = np.random.RandomState(seed)
+    permutation = rng.permutation(n_samples)
+    sizes = np.minimum(rng.geometric(1. / mean_size, n_nodes), n_samples)
+    starts = rng.randint(0, n_samples, n_nodes)
+
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    positions = (np.repeat(starts - offsets[:-1], sizes) +
+                 np.arange(offsets[-1])) % n_samples
+    return tuple(np.split(permutation[positions], offsets[1:-1]))
+
+
+def get_synthetic_graph(n_samples, n_nodes, mean_size=20, seed=0):
+    '''Function to generate a Mapper-like graph: nodes from
+    `get_synthetic_node_elements`, connected when they share data points.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of data points
+    n_nodes : int
+        Number of nodes
+    mean_size : int (default: 20)
+        Mean number of data points per node
+    seed : int (default: 0)
+        Seed of the memberships
+
+    Returns
+    -------
+    graph : igraph object
+        Graph with the node elements in graph['node_metadata']
+    '''
+
+    import igraph
+
+    node_elements = get_synthetic_node_elements(n_samples, n_nodes,
+                                                mean_size, seed)
+    membership = utils.get_node_membership(node_elements, n_samples)
+    overlap = (membership @ membership.T).tocoo()
+    upper = overlap.row < overlap.col
+
+    graph = igraph.Graph(n=n_nodes, edges=list(zip(
+        overlap.row[upper].tolist(), overlap.col[upper].tolist())))
+    graph['node_metadata'] = {'node_id': np.arange(n_nodes),
+                              'node_elements': node_elements}
+    return graph
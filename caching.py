@@ -0,0 +1,247 @@
+import collections
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from joblib import hash as joblib_hash
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+
+import instrumentation
+
+_GRAPH_CACHE = collections.OrderedDict()
+_GRAPH_CACHE_SIZE = 16
+
+_CACHE_DIR = os.environ.get(
+    'MAPPER_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'us-election-tda'))
+
+
+def get_array_fingerprint(x):
+    '''Function to compute a fingerprint of the content of an array.
+
+    Parameters
+    ----------
+    x : ndarray
+
+    Returns
+    -------
+    fingerprint : str
+        Hex digest of the shape, dtype and values of `x`
+    '''
+
+    x = np.ascontiguousarray(x)
+    digest = hashlib.sha1(f'{x.shape}{x.dtype.str}'.encode())
+    digest.update(x.view(np.uint8).ravel() if x.size else b'')
+    return digest.hexdigest()
+
+
+def _get_param_key(value):
+    # estimators (alone or in the steps of a pipeline) are represented by
+    # their class name, their hyper-parameters being deep parameters anyway
+    if hasattr(value, 'get_params'):
+        return type(value).__name__
+    if isinstance(value, (list, tuple)):
+        return [_get_param_key(x) for x in value]
+    return value
+
+
+def get_pipeline_key(pipeline):
+    '''Function to compute a key from the hyper-parameters of a pipeline.
+    The key is computed on an unfitted clone, nested estimators (including
+    `steps` and `transformer_list`) are represented by their class name and
+    `memory` is ignored, so that the key is the same before and after the
+    pipeline is fitted.
+
+    Parameters
+    ----------
+    pipeline : MapperPipeline
+
+    Returns
+    -------
+    key : str
+        Hash of the pipeline parameters
+    '''
+
+    params = {name: _get_param_key(value)
+              for name, value in clone(pipeline).get_params(deep=True).items()
+              if name != 'memory' and not name.endswith('__memory')}
+    return joblib_hash((type(pipeline).__name__, sorted(params.items())))
+
+
+def get_mapper_graph(pipeline, data):
+    '''Function to get the Mapper graph of `data`, fitting `pipeline` only if
+    the same parameters were not already fitted on the same data.
+
+    Parameters
+    ----------
+    pipeline : MapperPipeline
+        The Mapper pipeline to compute the mapper-graph
+    data : ndarray (n_samples x n_dim)
+        Data used for mapper
+
+    Returns
+    -------
+    graph : igraph object
+        Mapper graph
+    '''
+
+    key = (get_pipeline_key(pipeline), get_array_fingerprint(data))
+
+    if key in _GRAPH_CACHE:
+        _GRAPH_CACHE.move_to_end(key)
+        return _GRAPH_CACHE[key]
+
+    with instrumentation.span('fit'), \
+            instrumentation.instrument_steps(pipeline):
+        graph = pipeline.fit_transform(data)
+    # the key computed before fitting is the one unfitted pipelines give
+    _store_graph(key, graph)
+
+    return graph
+
+
+def set_mapper_graph(pipeline, data, graph):
+    '''Function to store a Mapper graph computed elsewhere (e.g. in a worker
+    process) in the graph cache.
+
+    Parameters
+    ----------
+    pipeline : MapperPipeline
+        The Mapper pipeline used to compute the mapper-graph
+    data : ndarray (n_samples x n_dim)
+        Data used for mapper
+    graph : igraph object
+        Mapper graph
+    '''
+
+    _store_graph((get_pipeline_key(pipeline), get_array_fingerprint(data)),
+                 graph)
+
+
+def _store_graph(key, graph):
+    _GRAPH_CACHE[key] = graph
+    _GRAPH_CACHE.move_to_end(key)
+    while len(_GRAPH_CACHE) > _GRAPH_CACHE_SIZE:
+        _GRAPH_CACHE.popitem(last=False)
+
+
+def set_graph_cache_size(size):
+    '''Function to set the maximum number of Mapper graphs kept in the cache.
+    Least recently used graphs are dropped first.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of cached graphs
+    '''
+
+    global _GRAPH_CACHE_SIZE
+    _GRAPH_CACHE_SIZE = size
+    while len(_GRAPH_CACHE) > _GRAPH_CACHE_SIZE:
+        _GRAPH_CACHE.popitem(last=False)
+
+
+def clear_graph_cache():
+    '''Function to remove all Mapper graphs from the cache.'''
+
+    _GRAPH_CACHE.clear()
+
+
+class CachedMapperPipeline(BaseEstimator, TransformerMixin):
+    '''Wrapper around a Mapper pipeline whose `fit_transform` reads from the
+    graph cache. It can be passed to `plot_static_mapper_graph` (which clones
+    and fits the pipeline it is given) to reuse an already computed graph.
+
+    Parameters
+    ----------
+    pipeline : MapperPipeline
+        The Mapper pipeline to compute the mapper-graph
+    '''
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def fit(self, X, y=None):
+        self.graph_ = get_mapper_graph(self.pipeline, X)
+        return self
+
+    def transform(self, X, y=None):
+        return get_mapper_graph(self.pipeline, X)
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).graph_
+
+
+def get_cache_dir(cache_dir=None):
+    '''Function to get the directory of the on-disk cache. Defaults to the
+    `MAPPER_CACHE_DIR` environment variable or ~/.cache/us-election-tda.
+
+    Parameters
+    ----------
+    cache_dir : str (default: None)
+        Directory to use instead of the default one
+
+    Returns
+    -------
+    cache_dir : str
+        Existing cache directory
+    '''
+
+    cache_dir = _CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def load_arrays(key, names, cache_dir=None):
+    '''Function to open arrays stored in the on-disk cache. The arrays are
+    memory-mapped read-only, so that several processes share the same pages.
+
+    Parameters
+    ----------
+    key : str
+        Key the arrays were stored under
+    names : list
+        Names of the arrays
+    cache_dir : str (default: None)
+        Cache directory (see `get_cache_dir`)
+
+    Returns
+    -------
+    arrays : dict or None
+        Dictionary with names as keys and memory-mapped arrays as values, or
+        None if any of the arrays is not in the cache
+    '''
+
+    directory = os.path.join(get_cache_dir(cache_dir), key)
+    paths = [os.path.join(directory, f'{name}.npy') for name in names]
+    if not all(map(os.path.exists, paths)):
+        return None
+
+    return {name: np.load(path, mmap_mode='r')
+            for name, path in zip(names, paths)}
+
+
+def save_arrays(key, arrays, cache_dir=None):
+    '''Function to store arrays in the on-disk cache as .npy files. Every
+    file is written under a temporary name and then renamed, so that
+    concurrent readers never see a partial file.
+
+    Parameters
+    ----------
+    key : str
+        Key to store the arrays under
+    arrays : dict
+        Dictionary with names as keys and arrays as values
+    cache_dir : str (default: None)
+        Cache directory (see `get_cache_dir`)
+    '''
+
+    directory = os.path.join(get_cache_dir(cache_dir), key)
+    os.makedirs(directory, exist_ok=True)
+
+    for name, x in arrays.items():
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(x))
+        os.replace(tmp_path, os.path.join(directory, f'{name}.npy'))
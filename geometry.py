@@ -0,0 +1,203 @@
+import collections
+
+import numpy as np
+import plotly.graph_objects as go
+from joblib import hash as joblib_hash
+
+import caching
+
+CountyGeometry = collections.namedtuple(
+    'CountyGeometry', ['fips', 'county_name', 'state_name', 'offsets', 'x',
+                       'y', 'centroid_x', 'centroid_y', 'state_x', 'state_y'])
+
+_GEOMETRY_CACHE = {}
+
+USA_XRANGE = [-125., -55.]
+USA_YRANGE = [25., 49.]
+EXTRA_STATES = ['Alaska', 'Commonwealth of the Northern Mariana Islands',
+                'Puerto Rico', 'Guam', 'United States Virgin Islands',
+                'American Samoa']
+
+
+def _get_rings(shape, tolerance):
+    # exterior rings of the (simplified) polygons of a shape, each followed
+    # by a NaN to separate it from the next one in a plotly trace
+    polygons = getattr(shape, 'geoms', [shape])
+    rings = [np.asarray(polygon.simplify(tolerance).exterior.coords)
+             for polygon in polygons]
+    return np.concatenate([np.vstack([ring, [[np.nan, np.nan]]])
+                           for ring in rings])
+
+
+def load_county_geometry(simplify_county=0.02, simplify_state=0.02,
+                         cache_dir=None):
+    '''Function to load the county and state polygons used by
+    `ff.create_choropleth`, simplified with the given tolerances. The
+    polygons are flattened into coordinate arrays, kept in memory and in the
+    on-disk cache of `caching`, so that the shapefiles are only read once.
+
+    Parameters
+    ----------
+    simplify_county : float (default: 0.02)
+        Tolerance of the simplification of county polygons
+    simplify_state : float (default: 0.02)
+        Tolerance of the simplification of state polygons
+    cache_dir : str (default: None)
+        Cache directory (see `caching.get_cache_dir`)
+
+    Returns
+    -------
+    geometry : CountyGeometry
+        Named tuple of the sorted FIPS codes, county and state names,
+        offsets of the coordinates of each county in `x` and `y`, county
+        centroids and coordinates of the state borders
+    '''
+
+    key = joblib_hash(('county-geometry', simplify_county, simplify_state))
+    if key in _GEOMETRY_CACHE:
+        return _GEOMETRY_CACHE[key]
+
+    arrays = caching.load_arrays(key, CountyGeometry._fields, cache_dir)
+    if arrays is None:
+        from plotly.figure_factory._county_choropleth import (
+            _create_us_counties_df, st_to_state_name_dict, state_to_st_dict)
+
+        df, df_state = _create_us_counties_df(st_to_state_name_dict,
+                                              state_to_st_dict)
+        df = df.sort_values('FIPS')
+        df_state = df_state[~df_state['STATE_NAME'].isin(EXTRA_STATES)]
+
+        rings = [_get_rings(shape, simplify_county) for shape in df['geometry']]
+        state_rings = np.concatenate(
+            [_get_rings(shape, simplify_state)
+             for shape in df_state['geometry']])
+        centroids = np.array([[shape.centroid.x, shape.centroid.y]
+                              for shape in df['geometry']])
+        coords = np.concatenate(rings)
+
+        arrays = {
+            'fips': df['FIPS'].values.astype(np.int64),
+            'county_name': np.asarray(df['COUNTY_NAME'], dtype='U'),
+            'state_name': np.asarray(df['STATE_NAME'], dtype='U'),
+            'offsets': np.concatenate([[0], np.cumsum(list(map(len, rings)))]),
+            'x': coords[:, 0].astype(np.float32),
+            'y': coords[:, 1].astype(np.float32),
+            'centroid_x': centroids[:, 0].astype(np.float32),
+            'centroid_y': centroids[:, 1].astype(np.float32),
+            'state_x': state_rings[:, 0].astype(np.float32),
+            'state_y': state_rings[:, 1].astype(np.float32)}
+        caching.save_arrays(key, arrays, cache_dir)
+
+    _GEOMETRY_CACHE[key] = CountyGeometry(**{name: np.asarray(arrays[name])
+                                             for name in
+                                             CountyGeometry._fields})
+    return _GEOMETRY_CACHE[key]
+
+
+def get_choropleth(geometry, fips, values, colorscale, title='',
+                   show_state_data=False, legend_title='', asp=2.9):
+    '''Function to create a county choropleth from cached geometry. Like
+    `ff.create_choropleth` without binning, each distinct value is a level
+    drawn in the color of the same rank in `colorscale`, but the shapes of
+    all counties of a level are gathered with array indexing only.
+
+    Parameters
+    ----------
+    geometry : CountyGeometry
+        Output of `load_county_geometry`
+    fips : list
+        List of Federal Information Processing Standard (FIPS) county codes
+    values : list (n_counties)
+        List of values to color the counties by
+    colorscale : list
+        List with colors to color counties by, at least one per distinct value
+    title : str (default: '')
+        Title of figure
+    show_state_data : bool (default: False)
+        Boolean to (not) show state borders
+    legend_title : str (default: '')
+        Title of legend
+    asp : float (default: 2.9)
+        Aspect ratio of the map
+
+    Returns
+    -------
+    fig : plotly figure object
+    '''
+
+    fips = np.asarray(fips, dtype=np.int64)
+    values = np.asarray(values)
+
+    # levels are taken from all values, so that a level without known
+    # county does not shift the colors of the next ones
+    levels, level_idx = np.unique(values, return_inverse=True)
+    if len(colorscale) < len(levels):
+        raise ValueError(f'{len(levels)} distinct values given for '
+                         f'{len(colorscale)} colors.')
+
+    # drop counties without shape, as ff.create_choropleth does
+    county_idx = np.searchsorted(geometry.fips, fips).clip(
+        0, len(geometry.fips) - 1)
+    known = geometry.fips[county_idx] == fips
+    county_idx, values = county_idx[known], values[known]
+    level_idx = level_idx.ravel()[known]
+
+    # indices of the coordinates of the counties, grouped by level
+    order = np.argsort(level_idx, kind='stable')
+    starts = geometry.offsets[county_idx[order]]
+    lengths = geometry.offsets[county_idx[order] + 1] - starts
+    coord_idx = (np.repeat(starts - np.cumsum(lengths) + lengths, lengths) +
+                 np.arange(lengths.sum()))
+    level_bounds = np.concatenate([[0], np.cumsum(
+        np.bincount(level_idx[order], weights=lengths,
+                    minlength=len(levels)).astype(np.int64))])
+
+    data = [go.Scatter(x=geometry.x[coord_idx[start:stop]],
+                       y=geometry.y[coord_idx[start:stop]],
+                       mode='lines', fill='toself', fillcolor=color,
+                       line={'color': 'rgb(0, 0, 0)', 'width': 0},
+                       name=str(level), hoverinfo='none')
+            for level, color, start, stop in zip(levels, colorscale,
+                                                  level_bounds[:-1],
+                                                  level_bounds[1:])]
+
+    data.append(go.Scatter(
+        x=geometry.centroid_x[county_idx], y=geometry.centroid_y[county_idx],
+        text=[f'County: {county}<br>State: {state}<br>'
+              f'FIPS: {str(f).zfill(5)}<br>Value: {value}'
+              for county, state, f, value in
+              zip(geometry.county_name[county_idx],
+                  geometry.state_name[county_idx],
+                  geometry.fips[county_idx], values)],
+        mode='markers', marker={'color': 'white', 'opacity': 0},
+        hoverinfo='text', showlegend=False, name='US Counties'))
+
+    if show_state_data:
+        data.append(go.Scatter(x=geometry.state_x, y=geometry.state_y,
+                               mode='lines', hoverinfo='text',
+                               showlegend=False,
+                               line={'color': 'rgb(240, 240, 240)',
+                                     'width': 1}))
+
+    # widen one of the ranges to the aspect ratio
+    xrange, yrange = list(USA_XRANGE), list(USA_YRANGE)
+    width, height = xrange[1] - xrange[0], yrange[1] - yrange[0]
+    if height / width > 1 / asp:
+        center = sum(xrange) / 2
+        xrange = [center - asp * height / 2, center + asp * height / 2]
+    else:
+        center = sum(yrange) / 2
+        yrange = [center - width / asp / 2, center + width / asp / 2]
+    axis = {'autorange': False, 'showgrid': False, 'zeroline': False,
+            'fixedrange': True, 'showticklabels': False}
+
+    return go.Figure(data=data, layout=go.Layout(
+        title=title, hovermode='closest',
+        xaxis=dict(axis, range=xrange), yaxis=dict(axis, range=yrange),
+        margin={'t': 40, 'b': 20, 'r': 20, 'l': 20}, width=900, height=450,
+        dragmode='select',
+        legend={'traceorder': 'reversed', 'xanchor': 'right',
+                'yanchor': 'top', 'x': 1, 'y': 1},
+        annotations=[{'x': 1, 'y': 1.05, 'xref': 'paper', 'yref': 'paper',
+                      'xanchor': 'right', 'showarrow': False,
+                      'text': f'<b>{legend_title}</b>'}]))
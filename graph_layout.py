@@ -0,0 +1,257 @@
+import igraph
+import numpy as np
+from joblib import hash as joblib_hash
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from scipy.spatial import cKDTree
+
+import caching
+import instrumentation
+import utils
+
+
+def get_graph_key(graph):
+    '''Function to compute a key of the structure of a graph, independent of
+    the order in which its edges are listed.
+
+    Parameters
+    ----------
+    graph : igraph object
+
+    Returns
+    -------
+    key : str
+        Hash of the number of vertices and of the sorted edge list
+    '''
+
+    edges = np.sort(np.array(graph.get_edgelist(), dtype=np.int64)
+                    .reshape(-1, 2), axis=1)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+    return joblib_hash((graph.vcount(), caching.get_array_fingerprint(edges)))
+
+
+def _scatter_add(idx, values, n):
+    return np.stack([np.bincount(idx, weights=values[:, j], minlength=n)
+                     for j in range(values.shape[1])], axis=1)
+
+
+def _get_component_coords(edges, n):
+    # spectral layout of a connected graph: eigenvectors of the second and
+    # third smallest eigenvalues of the Laplacian, scaled to unit edge length
+    if n <= 3:
+        angles = 2 * np.pi * np.arange(n) / n
+        return .5 * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    adjacency = sparse.coo_matrix((np.ones(len(edges)), edges.T),
+                                  shape=(n, n)).tocsr()
+    adjacency = ((adjacency + adjacency.T) > 0).astype(float)
+    laplacian = sparse.diags(np.asarray(adjacency.sum(axis=1)).ravel()) - \
+        adjacency
+    _, vectors = eigsh(laplacian, k=3, sigma=-1e-3,
+                       v0=np.ones(n) / np.sqrt(n))
+    coords = vectors[:, 1:]
+
+    edge_length = np.sqrt(((coords[edges[:, 0]] -
+                            coords[edges[:, 1]]) ** 2).sum(axis=1)).mean()
+    return coords / max(edge_length, 1e-12)
+
+
+def get_spectral_coords(graph):
+    '''Function to compute initial positions of a graph: every connected
+    component gets a spectral layout, and the components are packed in rows
+    by decreasing size.
+
+    Parameters
+    ----------
+    graph : igraph object
+
+    Returns
+    -------
+    coords : ndarray (n_vertices x 2)
+        Positions of the vertices
+    '''
+
+    n = graph.vcount()
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    component_ids = np.asarray(graph.components().membership)
+    component_sizes = np.bincount(component_ids)
+
+    # vertices and edges of every component, relabeled within the component
+    vertex_order = np.argsort(component_ids, kind='stable')
+    local_ids = np.empty(n, dtype=np.int64)
+    local_ids[vertex_order] = (np.arange(n) -
+                               np.repeat(np.cumsum(component_sizes) -
+                                         component_sizes, component_sizes))
+    edge_order = np.argsort(component_ids[edges[:, 0]], kind='stable')
+    edge_bounds = np.concatenate([[0], np.cumsum(np.bincount(
+        component_ids[edges[:, 0]], minlength=len(component_sizes)))])
+    vertex_bounds = np.concatenate([[0], np.cumsum(component_sizes)])
+
+    coords = np.zeros((n, 2))
+    row_width = 2 * np.sqrt(n) + 1
+    x, y, row_height = 0., 0., 0.
+    for c in np.argsort(-component_sizes, kind='stable'):
+        vertices = vertex_order[vertex_bounds[c]:vertex_bounds[c + 1]]
+        component_edges = local_ids[
+            edges[edge_order[edge_bounds[c]:edge_bounds[c + 1]]]]
+        component_coords = _get_component_coords(component_edges,
+                                                 len(vertices))
+        component_coords -= component_coords.min(axis=0)
+        width, height = component_coords.max(axis=0) + 1
+
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0., y + row_height, 0.
+        coords[vertices] = component_coords + [x, y]
+        x, row_height = x + width, max(row_height, height)
+
+    return coords
+
+
+def get_force_layout(graph, init_coords=None, n_iter=100, gravity=.01,
+                     seed=0):
+    '''Function to compute a force-directed layout of a graph (grid variant
+    of Fruchterman-Reingold). Edges attract their vertices, and vertices
+    closer than twice the ideal edge length repel each other. These pairs are
+    found with a k-d tree, so every iteration is vectorized and close to
+    linear in the size of the graph.
+
+    Parameters
+    ----------
+    graph : igraph object
+    init_coords : ndarray (n_vertices x 2) (default: None)
+        Initial positions. If None, the spectral positions of
+        `get_spectral_coords` are used
+    n_iter : int (default: 100)
+        Number of iterations
+    gravity : float (default: .01)
+        Strength of the pull towards the origin, keeping disconnected
+        components together
+    seed : int (default: 0)
+        Seed of the jitter of overlapping vertices
+
+    Returns
+    -------
+    coords : ndarray (n_vertices x 2)
+        Positions of the vertices
+    '''
+
+    n = graph.vcount()
+    rng = np.random.RandomState(seed)
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+
+    coords = (get_spectral_coords(graph) if init_coords is None
+              else np.array(init_coords, dtype=float))
+
+    for t in np.linspace(1., .01, n_iter):
+        # separate overlapping vertices
+        coords += rng.uniform(-1e-6, 1e-6, coords.shape)
+
+        pairs = cKDTree(coords).query_pairs(2., output_type='ndarray')
+        delta = coords[pairs[:, 0]] - coords[pairs[:, 1]]
+        force = delta / (delta ** 2).sum(axis=1)[:, None]
+        displacement = (_scatter_add(pairs[:, 0], force, n) -
+                        _scatter_add(pairs[:, 1], force, n))
+
+        delta = coords[edges[:, 0]] - coords[edges[:, 1]]
+        force = delta * np.sqrt((delta ** 2).sum(axis=1))[:, None]
+        displacement -= (_scatter_add(edges[:, 0], force, n) -
+                         _scatter_add(edges[:, 1], force, n))
+
+        displacement -= gravity * coords
+
+        length = np.sqrt((displacement ** 2).sum(axis=1)).clip(1e-12)
+        coords += displacement * (np.minimum(length, t) / length)[:, None]
+
+    return coords
+
+
+def get_warm_start_coords(graph, reference_graph, reference_coords, seed=0):
+    '''Function to place the nodes of a Mapper graph at the mean position of
+    the nodes of another Mapper graph (on the same data points) they share
+    data points with, weighted by the number of shared points.
+
+    Parameters
+    ----------
+    graph : igraph object
+        Mapper graph to place
+    reference_graph : igraph object
+        Mapper graph with known positions
+    reference_coords : ndarray (n_reference_nodes x 2)
+        Positions of the nodes of `reference_graph`
+    seed : int (default: 0)
+        Seed of the positions of nodes sharing no point with the reference
+
+    Returns
+    -------
+    coords : ndarray (n_nodes x 2)
+        Initial positions of the nodes of `graph`
+    '''
+
+    membership = utils.get_node_membership(
+        graph['node_metadata']['node_elements'])
+    reference_membership = utils.get_node_membership(
+        reference_graph['node_metadata']['node_elements'])
+    n_samples = max(membership.shape[1], reference_membership.shape[1])
+    membership.resize(membership.shape[0], n_samples)
+    reference_membership.resize(reference_membership.shape[0], n_samples)
+
+    overlap = membership @ reference_membership.T
+    n_shared = np.asarray(overlap.sum(axis=1)).ravel()
+    reference_coords = np.asarray(reference_coords, dtype=float)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coords = (overlap @ reference_coords) / n_shared[:, None]
+
+    unplaced = n_shared == 0
+    coords[unplaced] = np.random.RandomState(seed).uniform(
+        reference_coords.min(axis=0), reference_coords.max(axis=0),
+        (unplaced.sum(), 2))
+
+    return coords
+
+
+def get_graph_layout(graph, reference=None, n_iter=100, seed=0,
+                     cache_dir=None):
+    '''Function to get a layout of a Mapper graph from the on-disk layout
+    cache, which is keyed by the structure of the graph (see
+    `get_graph_key`). On a miss, the layout is computed with
+    `get_force_layout` and stored.
+
+    Parameters
+    ----------
+    graph : igraph object
+        Mapper graph
+    reference : tuple (default: None)
+        Tuple of a similar Mapper graph and its layout (igraph layout or
+        array of positions), to start the computation from (see
+        `get_warm_start_coords`), so that consecutive refits give similar
+        pictures
+    n_iter : int (default: 100)
+        Number of iterations of the force-directed layout
+    seed : int (default: 0)
+        Seed of the force-directed layout
+    cache_dir : str (default: None)
+        Cache directory (see `caching.get_cache_dir`)
+
+    Returns
+    -------
+    layout : igraph.layout.Layout
+        Layout of graph
+    '''
+
+    key = joblib_hash(('graph-layout', get_graph_key(graph), n_iter, seed))
+
+    arrays = caching.load_arrays(key, ['coords'], cache_dir)
+    if arrays is None:
+        init_coords = (None if reference is None else
+                       get_warm_start_coords(
+                           graph, reference[0],
+                           getattr(reference[1], 'coords', reference[1]),
+                           seed))
+        with instrumentation.span('layout'):
+            arrays = {'coords': get_force_layout(graph, init_coords, n_iter,
+                                                 seed=seed)}
+        caching.save_arrays(key, arrays, cache_dir)
+
+    return igraph.Layout(np.asarray(arrays['coords']).tolist())
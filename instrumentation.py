@@ -0,0 +1,273 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_ENABLED = False
+_TRACE_MEMORY = False
+_SPANS = []
+_LOCAL = threading.local()
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable(trace_memory=False):
+    '''Function to start recording spans.
+
+    Parameters
+    ----------
+    trace_memory : bool (default: False)
+        Boolean to (not) record the peak of memory allocated by Python within
+        each span with tracemalloc, which slows the code down
+    '''
+
+    global _ENABLED, _TRACE_MEMORY
+    _ENABLED, _TRACE_MEMORY = True, trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    '''Function to stop recording spans.'''
+
+    global _ENABLED
+    _ENABLED = False
+    if _TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def clear():
+    '''Function to remove all recorded spans.'''
+
+    del _SPANS[:]
+
+
+def get_spans():
+    '''Function to get the recorded spans.
+
+    Returns
+    -------
+    spans : list
+        List of dicts, in the order the spans finished, with the name, path
+        of enclosing spans, start time, wall time and CPU time (in seconds),
+        resident set size at the end of the span and its change within the
+        span (in bytes, None where /proc is not available), peak resident
+        set size of the process since it started, not only within the span
+        (in bytes) and, if traced, peak Python allocation within the span
+        (in bytes)
+    '''
+
+    return list(_SPANS)
+
+
+def _get_rss():
+    # current resident set size, read from /proc (Linux only)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _get_process_peak_rss():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else 1024 * peak
+
+
+class _Span:
+    def __init__(self, name, args):
+        self.name, self.args = name, args
+
+    def __enter__(self):
+        stack = getattr(_LOCAL, 'stack', None)
+        if stack is None:
+            stack = _LOCAL.stack = []
+        self.path = '/'.join([span.name for span in stack] + [self.name])
+
+        self.trace_memory = _TRACE_MEMORY and hasattr(tracemalloc,
+                                                      'reset_peak')
+        if self.trace_memory:
+            # the peak is reset for this span, so keep the one of the
+            # enclosing span so far
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            self.memory_start, self.peak = current, current
+            tracemalloc.reset_peak()
+
+        stack.append(self)
+        self.rss_start = _get_rss()
+        self.start, self.cpu_start = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        rss = _get_rss()
+        stack = _LOCAL.stack
+        stack.pop()
+
+        record = {'name': self.name, 'path': self.path,
+                  'thread': threading.get_ident(), 'start': self.start,
+                  'wall_time': wall, 'cpu_time': cpu, 'rss': rss,
+                  'rss_delta': (None if rss is None or self.rss_start is None
+                                else rss - self.rss_start),
+                  'process_peak_rss': _get_process_peak_rss(),
+                  'args': self.args}
+        if self.trace_memory:
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            record['peak_memory'] = peak - self.memory_start
+        _SPANS.append(record)
+        return False
+
+
+def _is_in_span(name):
+    stack = getattr(_LOCAL, 'stack', None)
+    return bool(stack) and stack[-1].name == name
+
+
+def span(name, **args):
+    '''Function to record a stage, to be used as a context manager:
+
+        with instrumentation.span('fit', year=2016):
+            ...
+
+    Spans nest (e.g. year -> fit -> clustering). When recording is disabled
+    (see `enable`), a shared null context is returned.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    **args :
+        Values stored with the span (e.g. the year)
+
+    Returns
+    -------
+    context : context manager
+    '''
+
+    return _Span(name, args) if _ENABLED else _NULL_SPAN
+
+
+def timed(name=None):
+    '''Decorator recording every call of a function as a span. When
+    recording is disabled, it only adds a flag check to every call.
+
+    Parameters
+    ----------
+    name : str (default: None)
+        Name of the stage. If None, the name of the function is used
+    '''
+
+    def decorator(func):
+        stage = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with _Span(stage, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _get_steps(estimator):
+    # (name, estimator) pairs of the steps of a pipeline and of its nested
+    # pipelines and feature unions
+    steps = (getattr(estimator, 'steps', None) or
+             getattr(estimator, 'transformer_list', None) or [])
+    for name, step in steps:
+        if hasattr(step, 'fit_transform') or hasattr(step, 'transform'):
+            yield name, step
+            yield from _get_steps(step)
+
+
+def _timed_step(name, method):
+    # a step whose fit_transform calls its own transform is recorded once
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _is_in_span(name):
+            return method(*args, **kwargs)
+        with _Span(name, {}):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def instrument_steps(pipeline):
+    '''Context manager recording the `fit_transform` and `transform` calls of
+    every step of a (Mapper) pipeline as spans named after the steps (e.g.
+    'map_and_cover', 'clustering', 'nerve'). Does nothing when disabled.
+
+    Parameters
+    ----------
+    pipeline : sklearn Pipeline
+    '''
+
+    if not _ENABLED:
+        yield pipeline
+        return
+
+    patched = []
+    for name, step in _get_steps(pipeline):
+        for method in ['fit_transform', 'transform']:
+            if hasattr(step, method) and method not in vars(step):
+                setattr(step, method,
+                        _timed_step(name, getattr(step, method)))
+                patched.append((step, method))
+    try:
+        yield pipeline
+    finally:
+        for step, method in patched:
+            delattr(step, method)
+
+
+def export_json(path):
+    '''Function to write the recorded spans to a JSON file.
+
+    Parameters
+    ----------
+    path : str
+    '''
+
+    with open(path, 'w') as f:
+        json.dump(get_spans(), f, indent=2, default=str)
+
+
+def export_chrome_trace(path):
+    '''Function to write the recorded spans in the Chrome trace event format,
+    to be opened with chrome://tracing or https://ui.perfetto.dev.
+
+    Parameters
+    ----------
+    path : str
+    '''
+
+    spans = get_spans()
+    origin = min([s['start'] for s in spans], default=0)
+    events = [{'name': s['name'], 'ph': 'X', 'pid': os.getpid(),
+               'tid': s['thread'], 'ts': 1e6 * (s['start'] - origin),
+               'dur': 1e6 * s['wall_time'],
+               'args': dict(s['args'], cpu_time=s['cpu_time'],
+                            rss_delta=s['rss_delta'],
+                            process_peak_rss=s['process_peak_rss'],
+                            peak_memory=s.get('peak_memory'))}
+              for s in spans]
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f,
+                  default=str)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.base import clone
+
+import caching
+
+_SHARED_DATA = None
+
+
+def share_array(x):
+    '''Function to copy an array into a memory-mapped .npy file, placed in
+    shared memory (/dev/shm) when available. Worker processes opening the
+    file map the same pages instead of receiving a pickled copy.
+
+    Parameters
+    ----------
+    x : ndarray
+        Array to share
+
+    Returns
+    -------
+    path : str
+        Path of the shared .npy file, to be removed with `release_array`
+    '''
+
+    directory = tempfile.mkdtemp(
+        prefix='mapper-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    path = os.path.join(directory, 'data.npy')
+
+    shared = np.lib.format.open_memmap(path, mode='w+', dtype=x.dtype,
+                                       shape=x.shape)
+    shared[:] = x
+    shared.flush()
+    del shared
+
+    return path
+
+
+def attach_array(path):
+    '''Function to open a shared array read-only.
+
+    Parameters
+    ----------
+    path : str
+        Path returned by `share_array`
+
+    Returns
+    -------
+    x : ndarray
+        Memory-mapped array
+    '''
+
+    return np.load(path, mmap_mode='r')
+
+
+def release_array(path):
+    '''Function to remove a shared array.
+
+    Parameters
+    ----------
+    path : str
+        Path returned by `share_array`
+    '''
+
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def _init_worker(path):
+    global _SHARED_DATA
+    _SHARED_DATA = attach_array(path)
+
+
+def _fit_rows(pipeline, start, stop):
+    return pipeline.fit_transform(_SHARED_DATA[start:stop])
+
+
+def fit_mapper_graphs_by_year(pipeline, data_by_year, years=None,
+                              n_jobs=None):
+    '''Function to fit one Mapper graph per election year in a process pool.
+    The data of all years is placed once in shared memory and every worker
+    reads its rows from there. The graphs are also stored in the graph cache
+    of `caching`, so that plotting functions do not fit them again.
+
+    Parameters
+    ----------
+    pipeline : MapperPipeline
+        The Mapper pipeline to compute the mapper-graphs
+    data_by_year : dict
+        Dictionary with election year as key and corresponding economic data
+        as values (see `utils.split_data_by_year`)
+    years : list (default: None)
+        Years to fit. If None, all keys of `data_by_year` are fitted
+    n_jobs : int (default: None)
+        Number of worker processes. If None, the number of CPUs is used
+
+    Returns
+    -------
+    graphs : dict
+        Dictionary with election year as key and Mapper graph as value
+    '''
+
+    years = list(data_by_year.keys()) if years is None else list(years)
+
+    offsets = np.cumsum([0] + [data_by_year[year].shape[0]
+                               for year in years])
+    path = share_array(np.concatenate([data_by_year[year]
+                                       for year in years]))
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_worker,
+                                 initargs=(path,)) as executor:
+            futures = [executor.submit(_fit_rows, clone(pipeline),
+                                       offsets[i], offsets[i + 1])
+                       for i in range(len(years))]
+            graphs = dict(zip(years, [f.result() for f in futures]))
+    finally:
+        release_array(path)
+
+    for year in years:
+        caching.set_mapper_graph(pipeline, data_by_year[year], graphs[year])
+
+    return graphs
@@ -1,13 +1,20 @@
-import plotly.figure_factory as ff
 import utils
+import caching
+import geometry
+import graph_layout
+import instrumentation
+import region_engine
 import itertools
 import collections
+import base64
 from gtda.mapper import plot_static_mapper_graph
+import igraph
 import numpy as np
+import plotly.graph_objects as go
 
 
 def get_region_plot(pipe, data, layout, node_elements,
-                    colorscale):
+                    colorscale, regions=None):
     '''Function to generate a figure of the mapper graph colored by identified
     regions
     
@@ -24,13 +31,16 @@ def get_region_plot(pipe, data, layout, node_elements,
         node x
     colorscale : list
         List of colors to use for each region
+    regions : dict (default: None)
+        Dictionary of regions with ids as keys and set of nodes as values. If
+        None, `utils.get_regions()` is used
 
     Returns
     -------
     fig : igraph object
     '''
 
-    regions = utils.get_regions()
+    regions = utils.get_regions() if regions is None else regions
 
     # set node color:
     # 1. assign to each node of a region its color (zip())
@@ -46,6 +56,7 @@ def get_region_plot(pipe, data, layout, node_elements,
                      [zip(regions[region],
                           itertools.repeat(colorscale[region]))
                       for region in range(len(regions))])))).values()))
+
     # set plotly arguments:
     # 1. set uniform node size
     # 2. hide scale of marker color
@@ -56,89 +67,245 @@ def get_region_plot(pipe, data, layout, node_elements,
         'node_trace_marker_color': node_color
     }
     
-    fig = plot_static_mapper_graph(pipe, data,
-                                   layout, layout_dim=2,
-                                   color_by_columns_dropdown=False,
-                                   plotly_kwargs=plotly_kwargs)
+    with instrumentation.span('figure'):
+        fig = plot_static_mapper_graph(caching.CachedMapperPipeline(pipe),
+                                       data, layout, layout_dim=2,
+                                       color_by_columns_dropdown=False,
+                                       plotly_kwargs=plotly_kwargs)
     # update colors to fig
-    fig._data[1]['marker']['color'] = node_color # hack around with the new api
+    fig.data[1].marker.color = node_color
     return fig
 
 
-def get_graph_plot_colored_by_election_results(pipeline, year, df, data, keep_layout):
-    '''Function make plot of US with counties colored by winner of election
-    
+@instrumentation.timed('statistics')
+def get_election_node_attributes(pipeline, year, df, data, compact=False):
+    '''Function to compute the node colors, sizes and texts of a Mapper
+    graph colored by the results of an election
+
     Parameters
     ----------
-    pipe : MapperPipeline
+    pipeline : MapperPipeline
         The Mapper pipeline to compute the mapper-graph
     year : np.int
         Color by election results from year `year`
-    df : pandas data frame
-        Data frame containing info of winner per county, year of election and
-        number of electors in county
+    df : ElectionData
+        Election arrays from `utils.get_election_data`
     data : ndarray (n_samples x n_dim)
         Data used for mapper
-    keep_layout : list of two dicts, with keys 'x', 'y', and such that values are 1d arrays
-        Positions of lines (keep_layout[0]) and markers respectively (keep_layout[1])
-        for the mapper graph
+    compact : bool (default: False)
+        Boolean to return the values of the node texts as an array (see
+        `utils.get_node_customdata`) instead of the texts
 
     Returns
     -------
-    fig: igraph object
+    node_attributes : tuple
+        Tuple of node colors (percentage of electors won by republicans),
+        node sizes (percentage of electors) and node texts (or their values)
     '''
 
-    node_elements = pipeline.fit_transform(data)['node_metadata']['node_elements']
+    node_elements = (caching.get_mapper_graph(pipeline, data)
+                     ['node_metadata']['node_elements'])
+    membership = utils.get_node_membership(node_elements, data.shape[0])
+    # the figure arrays have the precision of the data (e.g. float32)
+    dtype = utils.get_float_dtype(data)
 
     # set node color to percentage of number of electors won by republicans
-    node_color = np.array([
-        100 * (df[df['year'] == year]['winner'].values *
-               df[df['year'] == year]['n_electors'].values)[x].sum() /
-        df[df['year'] == year]['n_electors'].values[x].sum()
-        for x in node_elements])
+    node_color = utils.get_electors_won(membership, df, year).astype(
+        dtype, copy=False)
+
+    n_electors = utils.get_n_electors(
+        membership, utils.get_election_values(df, year, 'n_electors')).astype(
+        dtype, copy=False)
 
-    data_cols = utils.get_cols_for_mapper()
-    columns_to_color = dict(zip(data_cols, range(len(data_cols))))
+    if compact:
+        return (node_color, n_electors,
+                utils.get_node_customdata(membership, n_electors, node_color))
 
     node_text = utils.get_node_text(
         dict(zip(range(len(node_elements)),
                  node_elements)),
-        utils.get_n_electors(node_elements,
-                             df[df['year'] == year]['n_electors']
-                             .reset_index(drop=True)),
+        n_electors,
         node_color,
         'Percentage of Electors Won by Republicans')
 
+    return node_color, n_electors, node_text
+
+
+def get_graph_plot_colored_by_election_results(pipeline, year, df, data, keep_layout,
+                                               compact=False):
+    '''Function make plot of US with counties colored by winner of election
+    
+    Parameters
+    ----------
+    pipe : MapperPipeline
+        The Mapper pipeline to compute the mapper-graph
+    year : np.int
+        Color by election results from year `year`
+    df : pandas data frame or ElectionData
+        Data frame containing info of winner per county, year of election and
+        number of electors in county, or its arrays from
+        `utils.get_election_data` to avoid rebuilding them on every call
+    data : ndarray (n_samples x n_dim)
+        Data used for mapper
+    keep_layout : list of two dicts, with keys 'x', 'y', and such that values are 1d arrays
+        Positions of lines (keep_layout[0]) and markers respectively (keep_layout[1])
+        for the mapper graph. If None, the layout is read from the layout
+        cache of `graph_layout` (and computed on a miss)
+    compact : bool (default: False)
+        Boolean to (not) build the figure with `get_compact_graph_plot`, which
+        sends float32 arrays and renders the node texts in the browser,
+        instead of `plot_static_mapper_graph`
+
+    Returns
+    -------
+    fig: plotly FigureWidget
+    '''
+
+    if not isinstance(df, utils.ElectionData):
+        df = utils.get_election_data(df)
+
+    node_color, n_electors, node_text = get_election_node_attributes(
+        pipeline, year, df, data, compact)
+
+    graph = caching.get_mapper_graph(pipeline, data)
+    layout = (graph_layout.get_graph_layout(graph) if keep_layout is None
+              else igraph.Layout(list(zip(keep_layout[1]['x'],
+                                          keep_layout[1]['y']))))
+
+    if compact:
+        # mean of every column of the data, for the dropdown menu
+        columns = utils.get_cols_for_mapper()
+        color_options = utils.get_node_summaries(
+            graph['node_metadata']['node_elements'], data, ['mean'],
+            columns if len(columns) == data.shape[1] else None)
+        color_options.columns = color_options.columns.droplevel(1)
+
+        with instrumentation.span('figure'):
+            return get_compact_graph_plot(
+                layout.coords, graph.get_edgelist(), node_color, n_electors,
+                customdata=node_text,
+                hovertemplate=utils.get_node_hovertemplate(
+                    'Percentage of Electors Won by Republicans'),
+                marker={'colorscale': 'RdBu', 'reversescale': True,
+                        'cmin': 0, 'cmax': 100},
+                color_options=color_options)
+
     plotly_kwargs = {
         'node_trace_marker_colorscale': 'RdBu',
         'node_trace_marker_reversescale': True,
         'node_trace_marker_cmin': 0,
         'node_trace_marker_cmax': 100,
         'node_trace_text': node_text,
-        'node_trace_marker_size':
-        utils.get_n_electors(node_elements,
-                             df[df['year'] == year]['n_electors']
-                             .reset_index(drop=True)),
-        'node_trace_marker_sizeref':
-        .5 / max(utils.get_n_electors(node_elements,
-                                      df[df['year'] == year]['n_electors']
-                                      .reset_index(drop=True)))}
-
-    fig = plot_static_mapper_graph(pipeline, data,
-                                   'kk', layout_dim=2,
-                                   node_color_statistic=node_color,
-                                   color_by_columns_dropdown=True,
-                                   plotly_kwargs=plotly_kwargs)
-    if keep_layout is not None:
-        fig._data[0].update(keep_layout[0])
-        fig._data[1].update(keep_layout[1])
+        'node_trace_marker_size': n_electors,
+        'node_trace_marker_sizeref': .5 / max(n_electors)}
+
+    with instrumentation.span('figure'):
+        fig = go.FigureWidget(plot_static_mapper_graph(
+            caching.CachedMapperPipeline(pipeline), data, layout,
+            layout_dim=2, node_color_statistic=node_color,
+            color_by_columns_dropdown=True, plotly_kwargs=plotly_kwargs))
+    return fig
+
+
+def _set_default_color_option(fig, node_color):
+    # the 'Default' option of the dropdown of a compact figure (see
+    # `get_compact_graph_plot`) restores the current node colors
+    for menu in fig.layout.updatemenus:
+        for button in menu.buttons:
+            if button.label == 'Default' and button.method == 'restyle':
+                button.args = [dict(button.args[0],
+                                    **{'marker.color': [
+                                        _get_typed_array(node_color)]}),
+                               button.args[1]]
+
+
+def recolor_graph_plot(fig, node_color=None, node_size=None, node_text=None,
+                       customdata=None):
+    '''Function to change the node colors, sizes and texts of a Mapper graph
+    figure in place. Edges and node positions are kept, and all changes are
+    sent to the front end at once. The 'Default' option of the color
+    dropdown of a compact figure is set to the new colors.
+
+    Parameters
+    ----------
+    fig : plotly FigureWidget
+        Figure of a mapper graph (e.g. from
+        `get_graph_plot_colored_by_election_results`)
+    node_color : ndarray (default: None)
+        New node colors. If None, colors are not changed
+    node_size : ndarray (default: None)
+        New node sizes. If None, sizes are not changed
+    node_text : list (default: None)
+        New node texts. If None, texts are not changed
+    customdata : ndarray (default: None)
+        New values of the node texts of a compact figure (see
+        `get_compact_graph_plot`). If None, they are not changed
+
+    Returns
+    -------
+    fig: plotly FigureWidget
+    '''
+
+    node_trace = fig.data[1]
+    with fig.batch_update():
+        if node_color is not None:
+            node_trace.marker.color = node_color
+            _set_default_color_option(fig, node_color)
+        if node_size is not None:
+            node_trace.marker.size = node_size
+            node_trace.marker.sizeref = .5 / max(node_size)
+        if node_text is not None:
+            node_trace.text = node_text
+        if customdata is not None:
+            node_trace.customdata = customdata
+
     return fig
 
 
+def recolor_graph_plot_by_election_results(fig, pipeline, year, df, data):
+    '''Function to recolor a figure of
+    `get_graph_plot_colored_by_election_results` by the results of another
+    election, without refitting the pipeline or recomputing the layout
+
+    Parameters
+    ----------
+    fig : plotly FigureWidget
+        Figure of a mapper graph colored by election results
+    pipeline : MapperPipeline
+        The Mapper pipeline the figure was computed with
+    year : np.int
+        Color by election results from year `year`
+    df : pandas data frame or ElectionData
+        Data frame containing info of winner per county, year of election and
+        number of electors in county, or its arrays from
+        `utils.get_election_data`
+    data : ndarray (n_samples x n_dim)
+        Data used for mapper
+
+    Returns
+    -------
+    fig: plotly FigureWidget
+    '''
+
+    if not isinstance(df, utils.ElectionData):
+        df = utils.get_election_data(df)
+
+    node_color, n_electors, node_text = get_election_node_attributes(
+        pipeline, year, df, data, compact=fig.data[1].customdata is not None)
+    if fig.data[1].customdata is not None:
+        return recolor_graph_plot(fig, node_color, n_electors,
+                                  customdata=node_text)
+    return recolor_graph_plot(fig, node_color, n_electors, node_text)
+
+
+@instrumentation.timed('choropleth')
 def get_county_plot(fips, values, colorscale=["#0000ff", "#ff0000"], title='',
-                    show_state_data=False, legend_title='', showlegend=False):
+                    show_state_data=False, legend_title='', showlegend=False,
+                    simplify=0.02):
     '''Figure of the US colored on a county level
-    (inspired by # https://plot.ly/python/county-choropleth/)
+    (inspired by # https://plot.ly/python/county-choropleth/). The county
+    shapes are loaded and simplified once (see `geometry.load_county_geometry`)
+    and only the colors are bound to them on each call.
 
     Parameters
     ----------
@@ -156,96 +323,214 @@ def get_county_plot(fips, values, colorscale=["#0000ff", "#ff0000"], title='',
         Title of legend
     showlegend : bool (default: False)
         Boolean to (not) show legend
+    simplify : float (default: 0.02)
+        Tolerance of the simplification of county and state polygons
 
     Returns
     -------
     fig : plotly figure object
     '''
 
-    fig = ff.create_choropleth(fips=fips, values=values,
-                               colorscale=colorscale,
-                               show_state_data=show_state_data,
-                               show_hover=True, centroid_marker={'opacity': 0},
-                               asp=2.9, title=title,
-                               legend_title=legend_title)
+    fig = geometry.get_choropleth(geometry.load_county_geometry(simplify,
+                                                                simplify),
+                                  fips=fips, values=values,
+                                  colorscale=colorscale,
+                                  show_state_data=show_state_data,
+                                  title=title, legend_title=legend_title)
     fig.layout.template = None
     fig.update_layout(showlegend=showlegend)
     return fig
 
 
-def get_county_plot_by_region(data, colorscale, node_elements, fips):
+def get_county_plot_by_region(data, colorscale, node_elements, fips,
+                              regions=None):
     '''Function to create figure of US with counties colored by region they
-    belong to
+    belong to. Counties belonging to several regions are colored by the mean
+    RGB value of the colors of these regions.
 
     Parameters
     ----------
     data : ndarray (n_samples x n_dim)
         Data used for mapper
-    colorscale : list
-        List with colors to color counties by
+    colorscale : dict
+        Dictionary with hexa color codes as values, one per region
     node_elements : tuple
         Tuple of arrays where array at positin x contains the data points for
         node x
     fips : list
         List of Federal Information Processing Standard (FIPS) county codes
+    regions : dict (default: None)
+        Dictionary of regions with ids as keys and set of nodes as values. If
+        None, `utils.get_regions()` is used
 
     Returns
     -------
     fig: plotly figure object
     '''
 
-    # convert colorscale from hex format to rgb
-    colorscale = dict(zip(map(str, range(len(colorscale))),
-                          utils.hex2rgb(colorscale.values())))
-    # define color of counties belonging to two regions as their mean rgb value
-    colorscale['1-3'] = utils.mean_rgb([colorscale['1'],
-                                        colorscale['3']])
-    colorscale['2-3'] = utils.mean_rgb([colorscale['2'],
-                                        colorscale['3']])
-    colorscale['3-4'] = utils.mean_rgb([colorscale['3'],
-                                        colorscale['4']])
-    colorscale['4-5'] = utils.mean_rgb([colorscale['4'],
-                                        colorscale['5']])
-
-    elements_per_region = utils.get_data_per_region(utils.get_regions(),
-                                                    node_elements)
-
-    # assign each county its color
-    county_color = np.zeros(data.shape[0], dtype='int')
-    # region 0
-    county_color[list(elements_per_region[0])] = 0
-    # region 1 and not 3
-    county_color[list(elements_per_region[1]
-                      .difference(elements_per_region[3]))] = 1
-    # region 2 and not 3
-    county_color[list(elements_per_region[2]
-                      .difference(elements_per_region[3]))] = 2
-    # region 3 and neither 1 nor 2
-    county_color[list(elements_per_region[3]
-                      .difference(elements_per_region[1])
-                      .difference(elements_per_region[2]))] = 3
-    # region 4 but not 3
-    county_color[list(elements_per_region[4]
-                      .difference(elements_per_region[3]))] = 4
-    # region 5 but not 4
-    county_color[list(elements_per_region[5]
-                      .difference(elements_per_region[4]))] = 5
-
-    # region 1 and 3
-    county_color[list(elements_per_region[1]
-                      .intersection(elements_per_region[3]))] = 6
-    # region 2 and 3
-    county_color[list(elements_per_region[2]
-                      .intersection(elements_per_region[3]))] = 7
-    # region 3 and 4
-    county_color[list(elements_per_region[3]
-                      .intersection(elements_per_region[4]))] = 8
-    # region 4 and 5
-    county_color[list(elements_per_region[4]
-                      .intersection(elements_per_region[5]))] = 9
-
-    county_color = county_color.tolist()
+    regions = utils.get_regions() if regions is None else regions
+
+    region_membership = region_engine.get_region_membership(
+        regions, node_elements, data.shape[0])
+    signatures, county_color = region_engine.get_region_signatures(
+        region_membership)
+    signature_colors = region_engine.get_signature_colors(
+        signatures, list(colorscale.values()))
 
     return get_county_plot(
-        fips=fips, values=county_color,
-        colorscale=[f'rgb{rgb}' for rgb in list(colorscale.values())])
+        fips=fips, values=county_color.tolist(),
+        colorscale=[f'rgb{rgb}' for rgb in signature_colors])
+
+
+def _get_edge_coords(coords, edges, dtype=np.float64):
+    # coordinates of both ends of every edge, separated by NaNs
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+    edge_coords = np.full((len(edges), 3, 2), np.nan, dtype=dtype)
+    edge_coords[:, 0] = coords[edges[:, 0]]
+    edge_coords[:, 1] = coords[edges[:, 1]]
+    return edge_coords.reshape(-1, 2)
+
+
+def _get_typed_array(x, dtype=np.float32):
+    # plotly.js typed array spec: little-endian values encoded in base64,
+    # with the shape of arrays of more than one dimension
+    x = np.ascontiguousarray(x, dtype=np.dtype(dtype).newbyteorder('<'))
+    spec = {'dtype': x.dtype.str[1:],
+            'bdata': base64.b64encode(x.tobytes()).decode('ascii')}
+    if x.ndim > 1:
+        spec['shape'] = ','.join(map(str, x.shape))
+    return spec
+
+
+def get_compact_graph_plot(coords, edges, node_color, node_size=None,
+                           customdata=None, hovertemplate=None, marker=None,
+                           color_options=None):
+    '''Function to create a figure of a mapper graph with a small payload:
+    positions, colors, sizes and hover values are sent as base64-encoded
+    float32 typed arrays (requires plotly >= 6), and the node texts are
+    rendered by the browser from `hovertemplate` and `customdata`, so that no
+    string is built per node. The traces are in the order of
+    `plot_static_mapper_graph` (edges, then nodes), so that the figure can be
+    updated with `recolor_graph_plot`.
+
+    Parameters
+    ----------
+    coords : ndarray (n_nodes x 2)
+        Positions of the nodes
+    edges : list
+        List of pairs of node ids
+    node_color : ndarray
+        Node colors
+    node_size : ndarray (default: None)
+        Node sizes. If None, all nodes have the same size
+    customdata : ndarray (default: None)
+        Values of the node texts (e.g. from `utils.get_node_customdata`)
+    hovertemplate : str (default: None)
+        Template of the node texts (e.g. from
+        `utils.get_node_hovertemplate`). If None, the node ids are shown
+    marker : dict (default: None)
+        Further marker properties (e.g. colorscale)
+    color_options : pandas data frame (default: None)
+        Other node colors, one column per option of a dropdown menu placed
+        above the figure (e.g. a table of `utils.get_node_summaries`). The
+        first option restores `node_color`
+
+    Returns
+    -------
+    fig: plotly FigureWidget
+    '''
+
+    coords = np.asarray(coords, dtype=np.float32)
+    edge_coords = _get_edge_coords(coords, edges, np.float32)
+
+    node_marker = {'color': _get_typed_array(node_color),
+                   'colorscale': 'viridis', 'showscale': True,
+                   'line': {'width': 1, 'color': '#888'},
+                   'sizemode': 'area', 'sizemin': 4,
+                   'colorbar': {'thickness': 15, 'xanchor': 'left'}}
+    if node_size is not None:
+        node_marker.update(size=_get_typed_array(node_size),
+                           sizeref=.5 / np.max(node_size))
+    node_marker.update(marker or {})
+
+    updatemenus = []
+    if color_options is not None:
+        options = [('Default', node_marker['color'])] + [
+            (str(name), _get_typed_array(values))
+            for name, values in color_options.items()]
+        updatemenus = [{'buttons': [
+            {'label': name, 'method': 'restyle',
+             'args': [{'marker.color': [values], 'marker.cmin': None,
+                       'marker.cmax': None} if i else
+                      {'marker.color': [values],
+                       'marker.cmin': node_marker.get('cmin'),
+                       'marker.cmax': node_marker.get('cmax')}, [1]]}
+            for i, (name, values) in enumerate(options)],
+            'direction': 'down', 'x': 0, 'xanchor': 'left', 'y': 1.1,
+            'yanchor': 'top'}]
+
+    return go.FigureWidget(
+        data=[go.Scatter(x=_get_typed_array(edge_coords[:, 0]),
+                         y=_get_typed_array(edge_coords[:, 1]),
+                         name='edge_trace', mode='lines', hoverinfo='none',
+                         line={'color': '#888', 'width': 1}),
+              go.Scatter(x=_get_typed_array(coords[:, 0]),
+                         y=_get_typed_array(coords[:, 1]), name='node_trace',
+                         mode='markers', marker=node_marker,
+                         customdata=(None if customdata is None else
+                                     _get_typed_array(customdata)),
+                         hovertemplate=(hovertemplate or
+                                        'Node Id: %{pointNumber}'
+                                        '<extra></extra>'))],
+        layout=go.Layout(showlegend=False, hovermode='closest',
+                         template='simple_white', updatemenus=updatemenus,
+                         margin={'b': 20, 'l': 5, 'r': 5, 't': 40},
+                         xaxis={'visible': False},
+                         yaxis={'visible': False}))
+
+
+def get_subgraph_plot(view, coords=None, node_color=None, node_size=None,
+                      node_text=None):
+    '''Function to create a figure of a subgraph view of a mapper graph
+
+    Parameters
+    ----------
+    view : subgraph.SubgraphView
+        View of the mapper graph
+    coords : ndarray (n_vertices x 2) (default: None)
+        Positions of the vertices of the view. If None, they are computed with
+        `view.layout()`
+    node_color : ndarray (default: None)
+        Node colors, one per vertex of the view
+    node_size : ndarray (default: None)
+        Node sizes, one per vertex of the view
+    node_text : list (default: None)
+        Node texts, one per vertex of the view. If None, the ids of the nodes
+        in the original graph are shown
+
+    Returns
+    -------
+    fig: plotly figure object
+    '''
+
+    coords = view.layout() if coords is None else np.asarray(coords)
+    edge_coords = _get_edge_coords(coords, view.get_edgelist())
+
+    node_text = ([f'Node Id: {x}' for x in view.to_original(
+        np.arange(view.vcount()))] if node_text is None else node_text)
+    marker = {'color': node_color, 'colorscale': 'viridis',
+              'showscale': node_color is not None, 'line_width': .5}
+    if node_size is not None:
+        marker.update(size=node_size, sizemode='area',
+                      sizeref=2. * max(node_size) / 20 ** 2)
+
+    return go.FigureWidget(
+        data=[go.Scatter(x=edge_coords[:, 0], y=edge_coords[:, 1],
+                         mode='lines', hoverinfo='none',
+                         line={'color': '#888', 'width': 1}),
+              go.Scatter(x=coords[:, 0], y=coords[:, 1], mode='markers',
+                         hoverinfo='text', text=node_text, marker=marker)],
+        layout=go.Layout(showlegend=False, hovermode='closest',
+                         template=None,
+                         xaxis={'visible': False},
+                         yaxis={'visible': False}))
@@ -0,0 +1,455 @@
+import os
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+from joblib import hash as joblib_hash
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+
+import caching
+import instrumentation
+import utils
+
+
+class LogPCAFilter(BaseEstimator, TransformerMixin):
+    '''Filter computing a PCA followed by
+    `utils.log_transform_2d_filter_values`. The minimum of the first
+    component on the fitted data is stored, so that the rows of a new year
+    can be projected on the fitted components without refitting. Filter
+    values of float32 data are float32.
+
+    Parameters
+    ----------
+    n_components : int (default: 2)
+        Number of components
+    svd_solver : str (default: 'full')
+        'full' or 'randomized' for sklearn's PCA, or 'incremental' for
+        sklearn's IncrementalPCA, which can also be fitted chunk by chunk
+        (see `partial_fit`). The signs of the components, and so the filter
+        values, may differ between solvers
+    batch_size : int (default: None)
+        Number of rows per batch of IncrementalPCA
+    random_state : int (default: None)
+        Seed of the randomized solver
+    '''
+
+    def __init__(self, n_components=2, svd_solver='full', batch_size=None,
+                 random_state=None):
+        self.n_components = n_components
+        self.svd_solver = svd_solver
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def _get_pca(self):
+        if self.svd_solver == 'incremental':
+            return IncrementalPCA(n_components=self.n_components,
+                                  batch_size=self.batch_size)
+        return PCA(n_components=self.n_components, svd_solver=self.svd_solver,
+                   random_state=self.random_state)
+
+    def fit(self, X, y=None):
+        self.fit_transform(X)
+        return self
+
+    def fit_transform(self, X, y=None):
+        self.pca_ = self._get_pca()
+        projections = self.pca_.fit_transform(X)
+        self.min_ = projections[:, 0].min()
+        return utils.log_transform_2d_filter_values(projections, self.min_)
+
+    def partial_fit(self, X, y=None):
+        '''Function to update the components with a chunk of rows
+        (incremental solver only). As the components change with every
+        chunk, the minimum of the first component is reset, and must be
+        computed with `update_min` on all chunks once they are all fitted.
+
+        Parameters
+        ----------
+        X : ndarray (n_chunk_samples x n_dim)
+            Chunk of scaled data
+
+        Returns
+        -------
+        self : LogPCAFilter
+        '''
+
+        if self.svd_solver != 'incremental':
+            raise ValueError("partial_fit requires svd_solver='incremental'.")
+        if not hasattr(self, 'pca_'):
+            self.pca_ = self._get_pca()
+        self.pca_.partial_fit(X)
+        self.min_ = np.inf
+        return self
+
+    def update_min(self, X):
+        '''Function to take a chunk of fitted rows into account in the
+        minimum of the first component.
+
+        Parameters
+        ----------
+        X : ndarray (n_chunk_samples x n_dim)
+            Chunk of scaled data
+
+        Returns
+        -------
+        self : LogPCAFilter
+        '''
+
+        self.min_ = min(self.min_, self.pca_.transform(X)[:, 0].min())
+        return self
+
+    def transform(self, X, y=None):
+        if not np.isfinite(self.min_):
+            raise ValueError('The minimum of the first component is not '
+                             'known, call update_min after partial_fit.')
+        return utils.log_transform_2d_filter_values(self.pca_.transform(X),
+                                                    self.min_)
+
+
+def iter_chunks(source, columns=None, chunksize=100000):
+    '''Function to iterate over a data set in chunks of rows.
+
+    Parameters
+    ----------
+    source : str or function
+        Path of a CSV or Parquet file (the latter requires pyarrow), or
+        function returning an iterable of pandas data frames
+    columns : list (default: None)
+        Columns to read. If None, all columns are read
+    chunksize : int (default: 100000)
+        Number of rows per chunk (ignored if `source` is a function)
+
+    Returns
+    -------
+    chunks : generator
+        Generator of pandas data frames
+    '''
+
+    if callable(source):
+        for chunk in source():
+            yield chunk if columns is None else chunk[columns]
+    elif str(source).endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(f'Reading {source} requires pyarrow (pip '
+                              f'install pyarrow); convert it to CSV to '
+                              f'read it without.') from None
+
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize,
+                                                         columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunksize)
+
+
+def get_data_chunked(source, path, chunksize=100000, dtype=np.float64):
+    '''Function to extract data for Mapper from a data set that does not fit
+    in memory. Gives the same result as `utils.get_data`, but the data is
+    read in chunks:
+    1. a first pass finds the number of rows and the global minimum,
+    2. a second pass fits the scaler on the log-transformed chunks
+       (`partial_fit`); it cannot be merged with the first one as the log
+       shift depends on the global minimum,
+    3. a last pass writes the scaled chunks into a memory-mapped .npy file.
+    The scaler statistics are accumulated in float64 whatever `dtype`.
+
+    Parameters
+    ----------
+    source : str or function
+        Path of a CSV or Parquet file, or function returning an iterable of
+        pandas data frames (see `iter_chunks`)
+    path : str
+        Path of the .npy file to write the scaled data to
+    chunksize : int (default: 100000)
+        Number of rows per chunk
+    dtype : dtype (default: np.float64)
+        Type of the written data, e.g. np.float32 to halve its size
+
+    Returns
+    -------
+    data : numpy memmap
+        Scaled relevant data values, opened read-only
+    '''
+
+    data_cols = utils.get_cols_for_mapper()
+
+    n_samples, min_value = 0, np.inf
+    for chunk in iter_chunks(source, data_cols, chunksize):
+        n_samples += chunk.shape[0]
+        # missing values are ignored, as in `utils.get_data`
+        min_value = min(min_value, np.nanmin(chunk.values))
+    shift = abs(min_value) + 1
+
+    scaler = StandardScaler()
+    for chunk in iter_chunks(source, data_cols, chunksize):
+        scaler.partial_fit(np.log(chunk[data_cols].values + shift))
+
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                     shape=(n_samples, len(data_cols)))
+    start = 0
+    for chunk in iter_chunks(source, data_cols, chunksize):
+        stop = start + chunk.shape[0]
+        data[start:stop] = scaler.transform(
+            np.log(chunk[data_cols].values + shift))
+        start = stop
+    data.flush()
+    del data
+
+    return np.load(path, mmap_mode='r')
+
+
+def get_filter_values_chunked(data, path, filter_func=None,
+                              chunksize=100000, dtype=None):
+    '''Function to compute the filter values of data that does not fit in
+    memory (e.g. the memory map of `get_data_chunked`), in three passes over
+    chunks of rows: the components are fitted (`partial_fit`), then the
+    minimum of the first component is found (`update_min`), and the filter
+    values are written into a memory-mapped .npy file.
+
+    Parameters
+    ----------
+    data : ndarray (n_samples x n_dim)
+        Scaled data, e.g. a memory map
+    path : str
+        Path of the .npy file to write the filter values to
+    filter_func : LogPCAFilter (default: None)
+        Filter with the incremental solver. If None,
+        LogPCAFilter(svd_solver='incremental') is used
+    chunksize : int (default: 100000)
+        Number of rows per chunk
+    dtype : dtype (default: None)
+        Type of the written filter values. If None, the type of `data` is
+        used (float64 if it is not a floating point type)
+
+    Returns
+    -------
+    filter_values : numpy memmap
+        Filter values, opened read-only
+    filter_func : LogPCAFilter
+        Fitted filter, to project new rows with its `transform`
+    '''
+
+    filter_func = (LogPCAFilter(svd_solver='incremental')
+                   if filter_func is None else filter_func)
+    # chunks of similar sizes, so that none is smaller than n_components
+    edges = np.linspace(0, data.shape[0],
+                        int(np.ceil(data.shape[0] / chunksize)) + 1)
+    bounds = list(zip(edges[:-1].astype(int), edges[1:].astype(int)))
+
+    for start, stop in bounds:
+        filter_func.partial_fit(data[start:stop])
+    for start, stop in bounds:
+        filter_func.update_min(data[start:stop])
+
+    filter_values = np.lib.format.open_memmap(
+        path, mode='w+', dtype=utils.get_float_dtype(data, dtype),
+        shape=(data.shape[0], filter_func.n_components))
+    for start, stop in bounds:
+        filter_values[start:stop] = filter_func.transform(data[start:stop])
+    filter_values.flush()
+    del filter_values
+
+    return np.load(path, mmap_mode='r'), filter_func
+
+
+def get_mapper_input(df, filter_func=None, cache_dir=None,
+                     dtype=np.float64):
+    '''Function to get the Mapper input and the filter values of a data
+    frame, using an on-disk cache. The cache key is a hash of the Mapper
+    columns of `df`, the column list and the parameters of the transforms, so
+    that any change of them gives a new entry. Cached arrays are opened as
+    read-only memory maps. Unlike `utils.get_data`, `df` is not modified.
+
+    Parameters
+    ----------
+    df : pandas data frame
+    filter_func : estimator (default: None)
+        Filter applied to the scaled data before
+        `utils.log_transform_2d_filter_values`. If None, a two-dimensional
+        PCA is used
+    cache_dir : str (default: None)
+        Cache directory (see `caching.get_cache_dir`)
+    dtype : dtype (default: np.float64)
+        Type of the cached data and filter values, e.g. np.float32 to halve
+        their size. Both are computed in float64 before the conversion
+
+    Returns
+    -------
+    data : ndarray (n_samples x n_dim)
+        Scaled relevant data values
+    filter_values : ndarray (n_samples x 2)
+        Transformed filter values
+    '''
+
+    filter_func = PCA(n_components=2) if filter_func is None else filter_func
+    data_cols = utils.get_cols_for_mapper()
+
+    key = joblib_hash((
+        caching.get_array_fingerprint(
+            pd.util.hash_pandas_object(df[data_cols], index=False).values),
+        data_cols,
+        'log-standard-scaler',
+        caching.get_pipeline_key(filter_func),
+        'log_transform_2d_filter_values',
+        np.dtype(dtype).str))
+
+    arrays = caching.load_arrays(key, ['data', 'filter_values'], cache_dir)
+    if arrays is None:
+        # the filter is fitted in float64, only the results are converted
+        data = utils.get_data(df[data_cols].copy())
+        with instrumentation.span('filter'):
+            filter_values = utils.log_transform_2d_filter_values(
+                filter_func.fit_transform(data))
+        caching.save_arrays(key, {'data': data.astype(dtype, copy=False),
+                                  'filter_values': filter_values.astype(
+                                      dtype, copy=False)},
+                            cache_dir)
+        arrays = caching.load_arrays(key, ['data', 'filter_values'],
+                                     cache_dir)
+
+    return arrays['data'], arrays['filter_values']
+
+
+def get_column_dtypes(float_dtype=np.float32):
+    '''Function to get compact types of the columns of the BEA/MEDSL county
+    panel (see `utils.get_cols_by_type`). Vote counts stay exact in float32
+    up to 2 ** 24 and missing values remain NaN, so that numeric and election
+    columns are all stored as `float_dtype`.
+
+    Parameters
+    ----------
+    float_dtype : dtype (default: np.float32)
+        Type of the numeric and election columns
+
+    Returns
+    -------
+    dtypes : dict
+        Dictionary with columns as keys and types as values
+    '''
+
+    num_cols, info_cols, elec_cols = utils.get_cols_by_type()
+    dtypes = {col: np.dtype(float_dtype) for col in num_cols + elec_cols}
+    dtypes.update({'year': np.dtype(np.int16), 'state': 'category',
+                   'county': 'category', 'fips': np.dtype(np.int32),
+                   'pres': 'category'})
+
+    return dtypes
+
+
+def _read_county_csv(path, dtypes):
+    df = pd.read_csv(path, dtype=dtypes)
+    return df.sort_values(['year', 'fips'], kind='mergesort',
+                          ignore_index=True)
+
+
+def load_county_data(path, columns=None, cache_dir=None,
+                     float_dtype=np.float32):
+    '''Function to load the county panel from a CSV file with the types of
+    `get_column_dtypes`, sorted by year and FIPS code (see `get_year_slices`
+    and `get_county_rows`). The first load writes a Parquet copy (requires
+    pyarrow) to the on-disk cache, keyed by the path, size and modification
+    time of the file, and later loads read only `columns` from it. Without
+    pyarrow, a warning is issued and every load reads the CSV file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the CSV file
+    columns : list (default: None)
+        Columns to load. If None, all columns are loaded
+    cache_dir : str (default: None)
+        Cache directory (see `caching.get_cache_dir`)
+    float_dtype : dtype (default: np.float32)
+        Type of the numeric and election columns
+
+    Returns
+    -------
+    df : pandas data frame
+    '''
+
+    dtypes = get_column_dtypes(float_dtype)
+    try:
+        import pyarrow
+        import pyarrow.parquet as pq
+    except ImportError:
+        warnings.warn('pyarrow is not installed, the county data is read '
+                      'from the CSV file and not cached (pip install '
+                      'pyarrow to enable the Parquet cache).')
+        df = _read_county_csv(path, dtypes)
+        return df if columns is None else df[columns]
+
+    stat = os.stat(path)
+    key = joblib_hash((os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                       np.dtype(float_dtype).str, 'year-fips'))
+    cache_path = os.path.join(caching.get_cache_dir(cache_dir),
+                              f'{key}.parquet')
+
+    if not os.path.exists(cache_path):
+        df = _read_county_csv(path, dtypes)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path),
+                                        suffix='.parquet')
+        os.close(fd)
+        pq.write_table(pyarrow.Table.from_pandas(df, preserve_index=False),
+                       tmp_path)
+        os.replace(tmp_path, cache_path)
+        return df if columns is None else df[columns]
+
+    return pq.read_table(cache_path, columns=columns).to_pandas()
+
+
+def get_year_slices(df):
+    '''Function to get the rows of every year of a data frame sorted by year,
+    e.g. from `load_county_data`.
+
+    Parameters
+    ----------
+    df : pandas data frame
+
+    Returns
+    -------
+    year_slices : dict
+        Dictionary with years as keys and slices of row positions as values
+    '''
+
+    years = df['year'].values
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    stops = np.r_[starts[1:], len(years)]
+
+    return {int(years[start]): slice(start, stop)
+            for start, stop in zip(starts, stops)}
+
+
+def get_county_rows(df, fips, year, year_slices=None):
+    '''Function to find the rows of counties in a year of a data frame sorted
+    by year and FIPS code, by binary search.
+
+    Parameters
+    ----------
+    df : pandas data frame
+    fips : int or array-like
+        FIPS codes of the counties
+    year : int
+        Election year
+    year_slices : dict (default: None)
+        Output of `get_year_slices(df)`, computed if None
+
+    Returns
+    -------
+    rows : ndarray
+        Row positions of the counties, -1 for counties not in that year
+    '''
+
+    year_slices = get_year_slices(df) if year_slices is None else year_slices
+    rows = year_slices.get(int(year), slice(0, 0))
+    year_fips = df['fips'].values[rows]
+
+    fips = np.atleast_1d(fips)
+    positions = np.searchsorted(year_fips, fips)
+    found = positions < len(year_fips)
+    found[found] = year_fips[positions[found]] == fips[found]
+
+    return np.where(found, rows.start + positions, -1)
@@ -0,0 +1,160 @@
+import random
+
+import numpy as np
+
+import utils
+
+
+def get_region_membership(regions, node_elements, n_samples=None):
+    '''Function to compute which data points belong to which region.
+
+    Parameters
+    ----------
+    regions : dict
+        Dictionary of regions with ids as keys and set of nodes as values
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x, or membership matrix from `utils.get_node_membership`
+    n_samples : int (default: None)
+        Number of data points. If None, it is inferred from `node_elements`
+
+    Returns
+    -------
+    region_membership : ndarray (n_samples x n_regions)
+        Boolean matrix, entry (i, j) is True if data point i belongs to a node
+        of the j-th region of `regions`
+    '''
+
+    membership = utils.get_node_membership(node_elements, n_samples)
+
+    region_nodes = utils.get_region_nodes(regions, membership.shape[0])
+
+    return (membership.T @ region_nodes.T).toarray() > 0
+
+
+def get_region_signatures(region_membership):
+    '''Function to find the set of regions (signature) of every data point.
+    Rows of the membership matrix are packed into bitsets, so that the
+    distinct signatures are found with a single `np.unique`.
+
+    Parameters
+    ----------
+    region_membership : ndarray (n_samples x n_regions)
+        Output of `get_region_membership`
+
+    Returns
+    -------
+    signatures : ndarray (n_signatures x n_regions)
+        Boolean matrix of the distinct signatures, in increasing order of
+        their bitsets
+    signature_ids : ndarray (n_samples)
+        Index of the signature of each data point
+    '''
+
+    n_regions = region_membership.shape[1]
+    bitsets = np.packbits(region_membership, axis=1)
+
+    unique_bitsets, signature_ids = np.unique(bitsets, axis=0,
+                                              return_inverse=True)
+    signatures = np.unpackbits(unique_bitsets, axis=1,
+                               count=n_regions).astype(bool)
+
+    return signatures, signature_ids.ravel()
+
+
+def get_signature_colors(signatures, colorscale, empty_color='#d3d3d3'):
+    '''Function to get the color of each signature as the mean RGB value of
+    the colors of its regions.
+
+    Parameters
+    ----------
+    signatures : ndarray (n_signatures x n_regions)
+        Output of `get_region_signatures`
+    colorscale : list
+        List of hexa color codes, one per region
+    empty_color : str (default: '#d3d3d3')
+        Hexa color code of the signature without any region
+
+    Returns
+    -------
+    colors : list
+        List of tuples representing RGB codes, one per signature
+    '''
+
+    rgb = np.array(utils.hex2rgb(colorscale), dtype=float)
+    n_regions = signatures.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        colors = (signatures @ rgb) / n_regions[:, None]
+    colors[n_regions == 0] = utils.hex2rgb([empty_color])[0]
+
+    return list(map(tuple, colors.astype(int).tolist()))
+
+
+def detect_small_clusters(graph, min_component_size=4):
+    '''Function to get ids of singletons/small clusters, i.e. nodes of
+    connected components with fewer than `min_component_size` nodes.
+
+    Parameters
+    ----------
+    graph : igraph object
+        Mapper graph
+    min_component_size : int (default: 4)
+        Smallest number of nodes of a component not considered small
+
+    Returns
+    -------
+    ids : list
+        Sorted list of node ids of singletons/small clusters
+    '''
+
+    component_ids = np.asarray(graph.components().membership)
+    component_size = np.bincount(component_ids)
+
+    return np.flatnonzero(
+        component_size[component_ids] < min_component_size).tolist()
+
+
+def detect_regions(graph, min_component_size=4, resolution=1, seed=0):
+    '''Function to find regions of a Mapper graph. Region 0 gathers the
+    singletons/small clusters (see `detect_small_clusters`), the remaining
+    nodes are split into communities by the Louvain method. The random number
+    generator of igraph is seeded, so that the result is deterministic.
+
+    Parameters
+    ----------
+    graph : igraph object
+        Mapper graph
+    min_component_size : int (default: 4)
+        Smallest number of nodes of a component not considered small
+    resolution : float (default: 1)
+        Resolution of the modularity; larger values give more regions
+    seed : int (default: 0)
+        Seed of the community detection
+
+    Returns
+    -------
+    regions : dict
+        Dictionary with region id as key and sets of node ids belonging to
+        them, in the format of `utils.get_regions`. Regions other than 0 are
+        numbered by their smallest node id
+    '''
+
+    import igraph
+
+    small_clusters = detect_small_clusters(graph, min_component_size)
+    nodes = np.setdiff1d(np.arange(graph.vcount()), small_clusters)
+
+    subgraph = graph.induced_subgraph(nodes.tolist())
+    igraph.set_random_number_generator(random.Random(seed))
+    try:
+        communities = subgraph.community_multilevel(resolution=resolution)
+    finally:
+        igraph.set_random_number_generator(random)
+
+    community_ids = np.asarray(communities.membership)
+    regions = sorted(nodes[community_ids == i].tolist()
+                     for i in range(community_ids.max() + 1
+                                    if community_ids.size else 0))
+
+    return dict(enumerate([set(small_clusters)] + list(map(set, regions))))
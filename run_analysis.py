@@ -0,0 +1,411 @@
+'''Headless run of the whole analysis, from the county data to the figures.
+
+The analysis is a graph of stages (data, one Mapper graph and layout per
+year, regions, figures). Stages whose inputs are ready run in parallel worker
+processes, and the output of every stage is checkpointed to disk with a key
+of its parameters and of the keys of its inputs, so that a new run only
+recomputes the stages that failed, changed or depend on a changed stage.
+
+Run from the repository root, e.g.
+
+    python run_analysis.py data.csv --output artifacts --n-jobs 4
+'''
+import argparse
+import collections
+import functools
+import os
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import hash as joblib_hash
+
+import caching
+import graph_layout
+import region_engine
+import utils
+
+Stage = collections.namedtuple('Stage', ['name', 'func', 'deps', 'params'])
+
+REGION_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                 '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+
+def get_pipeline(n_intervals=10, overlap_frac=.3, eps=.5, min_samples=5):
+    '''Function to build the Mapper pipeline of the analysis.
+
+    Parameters
+    ----------
+    n_intervals : int (default: 10)
+        Number of intervals of the cover in each filter dimension
+    overlap_frac : float (default: .3)
+        Overlap of the intervals of the cover
+    eps : float (default: .5)
+        Maximum distance between two points of the same DBSCAN neighborhood
+    min_samples : int (default: 5)
+        Number of points of a neighborhood for a point to be a core point
+
+    Returns
+    -------
+    pipeline : MapperPipeline
+    '''
+
+    from gtda.mapper import CubicalCover, make_mapper_pipeline
+    from sklearn.cluster import DBSCAN
+
+    import preprocessing
+
+    return make_mapper_pipeline(
+        filter_func=preprocessing.LogPCAFilter(),
+        cover=CubicalCover(n_intervals=n_intervals,
+                           overlap_frac=overlap_frac),
+        clusterer=DBSCAN(eps=eps, min_samples=min_samples))
+
+
+def _get_year_rows(df, year):
+    return np.flatnonzero(df['year'].values == int(year))
+
+
+def run_data(path):
+    df = pd.read_csv(path).reset_index(drop=True)
+    return {'df': df, 'data': utils.get_data(df.copy())}
+
+
+def run_graph(inputs, year, pipeline_params):
+    df, data = inputs['data']['df'], inputs['data']['data']
+    rows = (np.arange(len(df)) if year == 'all'
+            else _get_year_rows(df, year))
+    return get_pipeline(**pipeline_params).fit_transform(data[rows])
+
+
+def run_layout(inputs, n_iter, seed):
+    return graph_layout.get_force_layout(
+        inputs['graph'], n_iter=n_iter, seed=seed)
+
+
+def run_regions(inputs, hand_tuned, min_component_size):
+    return (utils.get_regions() if hand_tuned else
+            region_engine.detect_regions(inputs['graph'],
+                                         min_component_size))
+
+
+def _export_figure(fig, path):
+    # static HTML (plotly.js from a CDN) and JSON of the figure
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fig.write_html(f'{path}.html', include_plotlyjs='cdn')
+    fig.write_json(f'{path}.json')
+    return [f'{path}.html', f'{path}.json']
+
+
+def run_election_figure(inputs, year, pipeline_params, path):
+    import plotting
+
+    df, data = inputs['data']['df'], inputs['data']['data']
+    year_data = data[_get_year_rows(df, year)]
+    pipeline = get_pipeline(**pipeline_params)
+    caching.set_mapper_graph(pipeline, year_data, inputs['graph'])
+
+    coords = inputs['layout']
+    fig = plotting.get_graph_plot_colored_by_election_results(
+        pipeline, int(year), utils.get_election_data(df), year_data,
+        [None, {'x': coords[:, 0], 'y': coords[:, 1]}], compact=True)
+    return _export_figure(fig, path)
+
+
+def run_region_graph_figure(inputs, pipeline_params, path):
+    import igraph
+
+    import plotting
+
+    data, graph = inputs['data']['data'], inputs['graph']
+    pipeline = get_pipeline(**pipeline_params)
+    caching.set_mapper_graph(pipeline, data, graph)
+
+    fig = plotting.get_region_plot(
+        pipeline, data, igraph.Layout(inputs['layout'].tolist()),
+        graph['node_metadata']['node_elements'],
+        [REGION_COLORS[i % len(REGION_COLORS)]
+         for i in range(len(inputs['regions']))],
+        inputs['regions'])
+    return _export_figure(fig, path)
+
+
+def run_region_map_figure(inputs, year, path):
+    import plotting
+
+    df, data = inputs['data']['df'], inputs['data']['data']
+    rows = _get_year_rows(df, year)
+    # nodes restricted to the counties of the year
+    membership = utils.get_node_membership(
+        inputs['graph']['node_metadata']['node_elements'], len(df))[:, rows]
+
+    fig = plotting.get_county_plot_by_region(
+        data[rows],
+        {region: REGION_COLORS[i % len(REGION_COLORS)]
+         for i, region in enumerate(inputs['regions'])},
+        membership, df['fips'].values[rows].tolist(), inputs['regions'])
+    return _export_figure(fig, path)
+
+
+def get_stages(input_path, output_dir, years, pipeline_params,
+               map_year=None, hand_tuned_regions=False, n_iter=100,
+               seed=0, min_component_size=4):
+    '''Function to define the stages of the analysis.
+
+    Parameters
+    ----------
+    input_path : str
+        Path of the CSV file of county data
+    output_dir : str
+        Directory of the figures
+    years : list
+        Election years to fit and plot
+    pipeline_params : dict
+        Parameters of `get_pipeline`
+    map_year : str (default: None)
+        Year of the map of regions. If None, the last of `years`
+    hand_tuned_regions : bool (default: False)
+        Boolean to use `utils.get_regions()` (tuned on the graph of the
+        original analysis) instead of `region_engine.detect_regions`
+    n_iter : int (default: 100)
+        Number of iterations of the layouts
+    seed : int (default: 0)
+        Seed of the layouts
+    min_component_size : int (default: 4)
+        Smallest number of nodes of a component not considered small
+
+    Returns
+    -------
+    stages : OrderedDict
+        Dictionary with stage names as keys and stages as values, in an
+        order where every stage comes after its dependencies
+    '''
+
+    stat = os.stat(input_path)
+    figure_dir = os.path.join(output_dir, 'figures')
+    map_year = years[-1] if map_year is None else map_year
+
+    stages = [Stage('data', functools.partial(run_data, input_path), [],
+                    (os.path.abspath(input_path), stat.st_size,
+                     stat.st_mtime))]
+    for year in ['all'] + list(years):
+        stages += [
+            Stage(f'graph-{year}',
+                  functools.partial(run_graph, year=year,
+                                    pipeline_params=pipeline_params),
+                  ['data'], (year, pipeline_params)),
+            Stage(f'layout-{year}',
+                  functools.partial(run_layout, n_iter=n_iter, seed=seed),
+                  [f'graph-{year}'], (n_iter, seed))]
+    for year in years:
+        path = os.path.join(figure_dir, f'election-graph-{year}')
+        stages.append(Stage(
+            f'figure-election-{year}',
+            functools.partial(run_election_figure, year=year,
+                              pipeline_params=pipeline_params, path=path),
+            ['data', f'graph-{year}', f'layout-{year}'],
+            (year, pipeline_params, path)))
+
+    stages += [
+        Stage('regions',
+              functools.partial(run_regions, hand_tuned=hand_tuned_regions,
+                                min_component_size=min_component_size),
+              ['graph-all'], (hand_tuned_regions, min_component_size)),
+        Stage('figure-region-graph',
+              functools.partial(run_region_graph_figure,
+                                pipeline_params=pipeline_params,
+                                path=os.path.join(figure_dir,
+                                                  'region-graph')),
+              ['data', 'graph-all', 'layout-all', 'regions'],
+              (pipeline_params, figure_dir)),
+        Stage('figure-region-map',
+              functools.partial(run_region_map_figure, year=map_year,
+                                path=os.path.join(figure_dir,
+                                                  f'region-map-{map_year}')),
+              ['data', 'graph-all', 'regions'], (map_year, figure_dir))]
+
+    return collections.OrderedDict((stage.name, stage) for stage in stages)
+
+
+def get_stage_keys(stages):
+    '''Function to compute the checkpoint key of every stage, from its name,
+    its parameters and the keys of its dependencies.
+
+    Parameters
+    ----------
+    stages : OrderedDict
+        Output of `get_stages`
+
+    Returns
+    -------
+    keys : dict
+        Dictionary with stage names as keys and keys as values
+    '''
+
+    keys = {}
+    for name, stage in stages.items():
+        keys[name] = joblib_hash((name, stage.params,
+                                  [keys[dep] for dep in stage.deps]))
+    return keys
+
+
+def _get_checkpoint_path(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, f'{name}.pkl')
+
+
+def _get_exported_files(output):
+    # figure stages return the list of paths of the files they export
+    if isinstance(output, list) and all(isinstance(x, str) for x in output):
+        return output
+    return []
+
+
+def is_checkpointed(checkpoint_dir, name, key):
+    '''Function to check whether a stage has a valid checkpoint. The
+    checkpoint of a stage exporting files (e.g. figures) is only valid if
+    all these files still exist.
+
+    Parameters
+    ----------
+    checkpoint_dir : str
+    name : str
+        Stage name
+    key : str
+        Key of the stage (see `get_stage_keys`)
+
+    Returns
+    -------
+    valid : bool
+    '''
+
+    key_path = _get_checkpoint_path(checkpoint_dir, name) + '.key'
+    if not os.path.exists(key_path):
+        return False
+    # the key file holds the key, followed by the exported files
+    with open(key_path) as f:
+        lines = f.read().split('\n')
+    return lines[0] == key and all(map(os.path.exists, lines[1:]))
+
+
+def _save_checkpoint(checkpoint_dir, name, key, output):
+    # the output is written before its key, and both are renamed into place,
+    # so that an interrupted stage never looks valid
+    path = _get_checkpoint_path(checkpoint_dir, name)
+    key_lines = '\n'.join([key] + [os.path.abspath(file) for file in
+                                   _get_exported_files(output)])
+    for target, write in [(path, lambda f: joblib.dump(output, f)),
+                          (path + '.key',
+                           lambda f: f.write(key_lines.encode()))]:
+        fd, tmp_path = tempfile.mkstemp(dir=checkpoint_dir)
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, target)
+
+
+def _run_stage(stage, checkpoint_dir, key):
+    inputs = {dep.split('-')[0]: joblib.load(
+        _get_checkpoint_path(checkpoint_dir, dep)) for dep in stage.deps}
+    output = stage.func(inputs) if stage.deps else stage.func()
+    _save_checkpoint(checkpoint_dir, stage.name, key, output)
+    return stage.name
+
+
+def run_stages(stages, checkpoint_dir, n_jobs=None, force=False):
+    '''Function to run the stages of the analysis in a pool of worker
+    processes. A stage is submitted as soon as all its dependencies have a
+    valid checkpoint, and stages with a valid checkpoint are skipped.
+    Workers read their inputs from the checkpoints, so that only stage names
+    go through the pool.
+
+    Parameters
+    ----------
+    stages : OrderedDict
+        Output of `get_stages`
+    checkpoint_dir : str
+        Directory of the checkpoints
+    n_jobs : int (default: None)
+        Number of worker processes. If None, the number of CPUs is used
+    force : bool (default: False)
+        Boolean to rerun all stages, ignoring the checkpoints
+
+    Returns
+    -------
+    status : dict
+        Dictionary with stage names as keys and 'cached', 'done', 'failed'
+        or 'skipped' (a dependency failed) as values
+    '''
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    keys = get_stage_keys(stages)
+
+    status = {name: 'cached' for name in stages
+              if not force and is_checkpointed(checkpoint_dir, name,
+                                               keys[name])}
+    pending = {}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        while True:
+            for name, stage in stages.items():
+                if name in status or name in pending.values():
+                    continue
+                if any(status.get(dep) in ('failed', 'skipped')
+                       for dep in stage.deps):
+                    status[name] = 'skipped'
+                elif all(status.get(dep) in ('cached', 'done')
+                         for dep in stage.deps):
+                    future = executor.submit(_run_stage, stage,
+                                             checkpoint_dir, keys[name])
+                    pending[future] = name
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    future.result()
+                    status[name] = 'done'
+                except Exception as e:
+                    status[name] = 'failed'
+                    print(f'{name} failed: {type(e).__name__}: {e}',
+                          file=sys.stderr)
+                print(f'{name:<30}{status[name]}')
+
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='CSV file of county data')
+    parser.add_argument('--output', default='artifacts',
+                        help='directory of the checkpoints and figures')
+    parser.add_argument('--years', nargs='+',
+                        default=['2000', '2004', '2008', '2012', '2016'])
+    parser.add_argument('--map-year', help='year of the map of regions')
+    parser.add_argument('--n-intervals', type=int, default=10)
+    parser.add_argument('--overlap-frac', type=float, default=.3)
+    parser.add_argument('--eps', type=float, default=.5)
+    parser.add_argument('--min-samples', type=int, default=5)
+    parser.add_argument('--hand-tuned-regions', action='store_true',
+                        help='use utils.get_regions() instead of detected '
+                             'regions')
+    parser.add_argument('--n-jobs', type=int)
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the checkpoints')
+    args = parser.parse_args(argv)
+
+    stages = get_stages(
+        args.input, args.output, args.years,
+        {'n_intervals': args.n_intervals, 'overlap_frac': args.overlap_frac,
+         'eps': args.eps, 'min_samples': args.min_samples},
+        args.map_year, args.hand_tuned_regions)
+    status = run_stages(stages, os.path.join(args.output, 'checkpoints'),
+                        args.n_jobs, args.force)
+
+    return int(any(s in ('failed', 'skipped') for s in status.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import collections
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from scipy import sparse
+from sklearn.base import clone
+
+import parallel
+import region_engine
+import utils
+
+_SHARED_DATA = None
+
+Stability = collections.namedtuple(
+    'Stability', ['regions', 'jaccard', 'region_stability', 'co_assignment',
+                  'county_stability', 'n_sampled'])
+
+
+def get_county_labels(regions, node_elements, n_samples, sample_ids=None):
+    '''Function to assign every county to the region containing most of the
+    nodes it belongs to.
+
+    Parameters
+    ----------
+    regions : dict
+        Dictionary of regions with ids as keys and set of nodes as values
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x, or membership matrix from `utils.get_node_membership`
+    n_samples : int
+        Number of counties
+    sample_ids : ndarray (default: None)
+        County of each data point the graph was fitted on, for a graph fitted
+        on a resample. If None, data point i is county i
+
+    Returns
+    -------
+    labels : ndarray (n_samples)
+        Region id of every county, -1 for counties in no node or not
+        sampled
+    '''
+
+    n_points = n_samples if sample_ids is None else len(sample_ids)
+    membership = utils.get_node_membership(node_elements, n_points)
+
+    region_nodes = utils.get_region_nodes(regions, membership.shape[0])
+
+    # number of nodes of every region each data point belongs to, summed
+    # over the copies of a county in a bootstrap resample
+    counts = membership.T @ region_nodes.T
+    if sample_ids is not None:
+        counts = sparse.csr_matrix(
+            (np.ones(n_points), (sample_ids, np.arange(n_points))),
+            shape=(n_samples, n_points)) @ counts
+    counts = counts.toarray()
+
+    # a replicate may have no region at all
+    if not regions:
+        return np.full(n_samples, -1)
+
+    region_ids = np.array(list(regions.keys()))
+    labels = region_ids[counts.argmax(axis=1)]
+    labels[counts.max(axis=1) == 0] = -1
+
+    return labels
+
+
+def _init_worker(path):
+    global _SHARED_DATA
+    _SHARED_DATA = parallel.attach_array(path)
+
+
+def _get_sample_ids(n_samples, method, subsample_frac, seed):
+    rng = np.random.RandomState(seed)
+    if method == 'bootstrap':
+        return np.sort(rng.randint(n_samples, size=n_samples))
+    if method == 'subsample':
+        return np.sort(rng.choice(n_samples, int(subsample_frac * n_samples),
+                                  replace=False))
+    raise ValueError(f"Unknown method '{method}', use 'bootstrap' or "
+                     f"'subsample'.")
+
+
+def _fit_replicate(pipeline, method, subsample_frac, seed, min_component_size,
+                   resolution):
+    n_samples = _SHARED_DATA.shape[0]
+    sample_ids = _get_sample_ids(n_samples, method, subsample_frac, seed)
+
+    graph = pipeline.fit_transform(np.asarray(_SHARED_DATA[sample_ids]))
+    regions = region_engine.detect_regions(graph, min_component_size,
+                                           resolution, seed=0)
+    labels = get_county_labels(regions,
+                               graph['node_metadata']['node_elements'],
+                               n_samples, sample_ids)
+
+    sampled = np.zeros(n_samples, dtype=bool)
+    sampled[sample_ids] = True
+    return sampled, labels.astype(np.int32)
+
+
+def run_stability_analysis(pipeline, data, reference_labels, n_replicates=100,
+                           method='bootstrap', subsample_frac=.8,
+                           min_component_size=4, resolution=1, seed=0,
+                           n_jobs=None):
+    '''Function to measure how stable regions of counties are when the Mapper
+    pipeline is refitted on resamples of the counties. The data is placed
+    once in shared memory, the refits run in a pool of worker processes, and
+    the regions of every refit (see `region_engine.detect_regions`) are
+    mapped back to counties with `get_county_labels`. Workers return one
+    label per county; these are folded into running totals as they arrive
+    and at most two replicates per worker are in flight, so memory does not
+    grow with `n_replicates`.
+
+    The stability of a reference region in a replicate is the largest
+    Jaccard index between its sampled counties and the counties of a region
+    of the replicate. The co-assignment frequency of a county with a
+    reference region is the mean fraction of the sampled counties of the
+    region that are in the same replicate region as the county.
+
+    Parameters
+    ----------
+    pipeline : MapperPipeline
+        The Mapper pipeline to refit
+    data : ndarray (n_samples x n_dim)
+        Data used for mapper, one row per county
+    reference_labels : ndarray (n_samples)
+        Region id of every county (-1 for none), e.g.
+        `get_county_labels(utils.get_regions(), node_elements, n_samples)`
+    n_replicates : int (default: 100)
+        Number of refits
+    method : str (default: 'bootstrap')
+        'bootstrap' (draw n_samples counties with replacement) or
+        'subsample' (draw a fraction of the counties without replacement)
+    subsample_frac : float (default: .8)
+        Fraction of counties drawn by 'subsample'
+    min_component_size : int (default: 4)
+        Smallest number of nodes of a component not considered small (see
+        `region_engine.detect_regions`)
+    resolution : float (default: 1)
+        Resolution of the community detection
+    seed : int (default: 0)
+        Seed of the resamples
+    n_jobs : int (default: None)
+        Number of worker processes. If None, the number of CPUs is used
+
+    Returns
+    -------
+    stability : Stability
+        Named tuple of the reference region ids, the Jaccard indices
+        (n_replicates x n_regions), their means per region, the
+        co-assignment frequencies (n_samples x n_regions), the frequency with
+        which every county stays with its own reference region, and the
+        number of replicates every county was drawn in
+    '''
+
+    reference_labels = np.asarray(reference_labels)
+    n_samples = reference_labels.shape[0]
+    regions, reference_ids = np.unique(reference_labels, return_inverse=True)
+    in_region = regions >= 0
+    regions = regions[in_region]
+    # reference ids of counties without region are set to len(regions)
+    reference_ids = np.where(in_region[reference_ids],
+                             np.cumsum(in_region)[reference_ids] - 1,
+                             len(regions))
+
+    seeds = np.random.RandomState(seed).randint(2 ** 31, size=n_replicates)
+    jaccard = np.zeros((n_replicates, len(regions)))
+    co_assignment = np.zeros((n_samples, len(regions)))
+    n_sampled = np.zeros(n_samples, dtype=np.int64)
+
+    def accumulate(i, sampled, labels):
+        counties = sampled & (labels >= 0)
+        _, label_ids = np.unique(labels[counties], return_inverse=True)
+        label_ids = label_ids.ravel()
+        n_labels = label_ids.max() + 1 if label_ids.size else 0
+
+        # contingency table of reference regions x replicate regions, over
+        # sampled counties
+        table = np.bincount(
+            reference_ids[counties] * n_labels + label_ids,
+            minlength=(len(regions) + 1) * n_labels).reshape(
+            len(regions) + 1, n_labels)[:len(regions)]
+        region_size = np.bincount(reference_ids[sampled],
+                                  minlength=len(regions) + 1)[:len(regions)]
+        label_size = np.bincount(label_ids, minlength=n_labels)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            jaccard[i] = (table / (region_size[:, None] + label_size - table)
+                          ).max(axis=1, initial=0)
+            fraction = np.nan_to_num(table / region_size[:, None])
+        jaccard[i, region_size == 0] = np.nan
+
+        co_assignment[counties] += fraction[:, label_ids].T
+        n_sampled[sampled] += 1
+
+    max_pending = 2 * (os.cpu_count() if n_jobs is None else n_jobs)
+    path = parallel.share_array(np.asarray(data))
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_worker,
+                                 initargs=(path,)) as executor:
+            pending, next_replicate = {}, 0
+            while pending or next_replicate < n_replicates:
+                while (next_replicate < n_replicates and
+                       len(pending) < max_pending):
+                    future = executor.submit(
+                        _fit_replicate, clone(pipeline), method,
+                        subsample_frac, seeds[next_replicate],
+                        min_component_size, resolution)
+                    pending[future] = next_replicate
+                    next_replicate += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    accumulate(pending.pop(future), *future.result())
+    finally:
+        parallel.release_array(path)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        co_assignment /= n_sampled[:, None]
+    own = reference_ids < len(regions)
+    county_stability = np.full(n_samples, np.nan)
+    county_stability[own] = co_assignment[own, reference_ids[own]]
+
+    return Stability(regions=regions, jaccard=jaccard,
+                     region_stability=np.nanmean(jaccard, axis=0),
+                     co_assignment=co_assignment,
+                     county_stability=county_stability, n_sampled=n_sampled)
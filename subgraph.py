@@ -0,0 +1,174 @@
+import collections
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+import graph_layout
+
+Components = collections.namedtuple('Components', ['membership'])
+
+
+class SubgraphView:
+    '''Subgraph of a graph defined by a mask over its vertices, without
+    copying the graph. The view has its own vertex ids (0 to the number of
+    kept vertices, in the order of the original ids) and shares the edge
+    array of the graph it was built from. It implements the part of the
+    igraph interface used by `graph_layout` and `region_engine`
+    (`vcount`, `ecount`, `get_edgelist`, `degree`, `components`,
+    `induced_subgraph` and the 'node_metadata' attribute, restricted to the
+    kept vertices).
+
+    Parameters
+    ----------
+    graph : igraph object
+        Original graph
+    mask : ndarray (default: None)
+        Boolean array, True for the vertices to keep. If None, all vertices
+        are kept
+    edges : ndarray (n_edges x 2) (default: None)
+        Edge list of `graph`, to share it between views. If None, it is read
+        from `graph`
+    '''
+
+    def __init__(self, graph, mask=None, edges=None):
+        self.graph = graph
+        self.edges = (np.array(graph.get_edgelist(), dtype=np.int64)
+                      .reshape(-1, 2) if edges is None else edges)
+        self.mask = (np.ones(graph.vcount(), dtype=bool) if mask is None
+                     else np.asarray(mask, dtype=bool))
+
+        self.vertex_ids = np.flatnonzero(self.mask)
+        local_ids = np.full(len(self.mask), -1, dtype=np.int64)
+        local_ids[self.vertex_ids] = np.arange(len(self.vertex_ids))
+        kept = self.mask[self.edges[:, 0]] & self.mask[self.edges[:, 1]]
+        self.edge_ids = np.flatnonzero(kept)
+        self._edges = local_ids[self.edges[kept]]
+
+    def vcount(self):
+        return len(self.vertex_ids)
+
+    def ecount(self):
+        return len(self.edge_ids)
+
+    def get_edgelist(self):
+        return list(map(tuple, self._edges.tolist()))
+
+    def degree(self):
+        return np.bincount(self._edges.ravel(), minlength=self.vcount())
+
+    def components(self):
+        adjacency = sparse.coo_matrix(
+            (np.ones(self.ecount()), self._edges.T),
+            shape=(self.vcount(), self.vcount()))
+        _, membership = connected_components(adjacency, directed=False)
+        return Components(membership=membership.tolist())
+
+    def induced_subgraph(self, vertices):
+        '''Function to copy the subgraph of the view induced by some of its
+        vertices into an igraph object, e.g. for community detection.
+
+        Parameters
+        ----------
+        vertices : iterable
+            Vertex ids of the view
+
+        Returns
+        -------
+        subgraph : igraph object
+            Graph whose vertices are `vertices`, in increasing order
+        '''
+
+        import igraph
+
+        vertices = np.unique(np.fromiter(vertices, dtype=np.int64))
+        local_ids = np.full(self.vcount(), -1, dtype=np.int64)
+        local_ids[vertices] = np.arange(len(vertices))
+        edges = local_ids[self._edges]
+        edges = edges[(edges >= 0).all(axis=1)]
+        return igraph.Graph(n=len(vertices), edges=edges.tolist())
+
+    def __getitem__(self, name):
+        # graph attributes; the node metadata is restricted to the view
+        if name != 'node_metadata':
+            return self.graph[name]
+        return {key: [values[i] for i in self.vertex_ids]
+                for key, values in self.graph[name].items()}
+
+    def layout(self, init_coords=None, n_iter=100, seed=0):
+        '''Function to compute a force-directed layout of the view (see
+        `graph_layout.get_force_layout`).
+
+        Returns
+        -------
+        coords : ndarray (n_vertices x 2)
+            Positions of the vertices of the view
+        '''
+
+        return graph_layout.get_force_layout(self, init_coords, n_iter,
+                                             seed=seed)
+
+    def restrict(self, vertices_to_remove):
+        '''Function to remove further vertices from the view.
+
+        Parameters
+        ----------
+        vertices_to_remove : iterable
+            Original ids of the vertices to remove (e.g. a region of
+            `utils.get_regions`)
+
+        Returns
+        -------
+        view : SubgraphView
+            New view on the same graph and edge array
+        '''
+
+        mask = self.mask.copy()
+        mask[np.fromiter(vertices_to_remove, dtype=np.int64)] = False
+        return SubgraphView(self.graph, mask, self.edges)
+
+    def to_original(self, ids):
+        '''Function to map vertex ids of the view to ids of the graph.
+
+        Parameters
+        ----------
+        ids : ndarray
+            Vertex ids of the view
+
+        Returns
+        -------
+        original_ids : ndarray
+            Vertex ids of the original graph
+        '''
+
+        return self.vertex_ids[ids]
+
+    def get_node_elements(self):
+        '''Function to get the data points of the nodes of the view.
+
+        Returns
+        -------
+        node_elements : tuple
+            Tuple of arrays where array at position x contains the data
+            points for node x of the view
+        '''
+
+        return tuple(self['node_metadata']['node_elements'])
+
+
+def get_subgraph_view(graph, vertices_to_remove):
+    '''Function to get a view of a graph without the given vertices. Unlike
+    `utils.get_subgraph`, the graph is not copied.
+
+    Parameters
+    ----------
+    graph : igraph object
+    vertices_to_remove : iterable
+        Vertices (defined by node id) to remove from graph
+
+    Returns
+    -------
+    view : SubgraphView
+    '''
+
+    return SubgraphView(graph).restrict(vertices_to_remove)
@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from gtda.mapper import make_mapper_pipeline
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.decomposition import PCA
+from sklearn.model_selection import ParameterGrid
+
+import parallel
+import region_engine
+import utils
+
+_SHARED_DATA = None
+_SHARED_FILTER_VALUES = None
+
+
+class PrecomputedFilter(BaseEstimator, TransformerMixin):
+    '''Filter returning precomputed filter values, so that a Mapper pipeline
+    does not recompute its filter when only the cover or the clusterer
+    change.
+
+    Parameters
+    ----------
+    filter_values : ndarray (n_samples x n_filter_dim)
+        Filter values of the data the pipeline is fitted on
+    '''
+
+    def __init__(self, filter_values):
+        self.filter_values = filter_values
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        if X.shape[0] != self.filter_values.shape[0]:
+            raise ValueError(f'Filter values of {self.filter_values.shape[0]}'
+                             f' samples given for {X.shape[0]} samples.')
+        return np.asarray(self.filter_values)
+
+
+def get_graph_statistics(graph, min_component_size=4):
+    '''Function to summarize a Mapper graph.
+
+    Parameters
+    ----------
+    graph : igraph object
+        Mapper graph
+    min_component_size : int (default: 4)
+        Smallest number of nodes of a component not considered small (see
+        `region_engine.detect_regions`)
+
+    Returns
+    -------
+    statistics : dict
+        Number of nodes, edges and connected components, and number of nodes
+        per detected region
+    '''
+
+    regions = region_engine.detect_regions(graph, min_component_size)
+
+    return {'n_nodes': graph.vcount(),
+            'n_edges': graph.ecount(),
+            'n_components': len(graph.components()),
+            'region_sizes': [len(regions[region]) for region in regions]}
+
+
+def _init_worker(data_path, filter_paths):
+    global _SHARED_DATA, _SHARED_FILTER_VALUES
+    _SHARED_DATA = parallel.attach_array(data_path)
+    _SHARED_FILTER_VALUES = list(map(parallel.attach_array, filter_paths))
+
+
+def _fit_configuration(filter_id, cover, clusterer, min_component_size):
+    pipeline = make_mapper_pipeline(
+        filter_func=PrecomputedFilter(_SHARED_FILTER_VALUES[filter_id]),
+        cover=cover, clusterer=clusterer)
+    return get_graph_statistics(pipeline.fit_transform(_SHARED_DATA),
+                                min_component_size)
+
+
+def run_mapper_sweep(data, cover, clusterer, cover_grid, clusterer_grid,
+                     filter_funcs=None, min_component_size=4, n_jobs=None):
+    '''Function to fit the Mapper pipeline for every combination of cover and
+    clusterer parameters. The filter values are computed once per filter
+    (followed by `utils.log_transform_2d_filter_values`) and shared, together
+    with the data, with a pool of worker processes fitting the cover and
+    clustering stages.
+
+    Parameters
+    ----------
+    data : ndarray (n_samples x n_dim)
+        Data used for mapper
+    cover : cover object
+        Cover whose parameters are swept (e.g. CubicalCover())
+    clusterer : clusterer object
+        Clusterer whose parameters are swept (e.g. DBSCAN())
+    cover_grid : dict or list
+        Grid of cover parameters, in the format of sklearn's ParameterGrid
+    clusterer_grid : dict or list
+        Grid of clusterer parameters, in the format of sklearn's
+        ParameterGrid
+    filter_funcs : dict (default: None)
+        Dictionary with names as keys and filters as values. If None, a
+        two-dimensional PCA is used
+    min_component_size : int (default: 4)
+        Smallest number of nodes of a component not considered small (see
+        `region_engine.detect_regions`)
+    n_jobs : int (default: None)
+        Number of worker processes. If None, the number of CPUs is used
+
+    Returns
+    -------
+    results : pandas data frame
+        One row per configuration with its parameters and the statistics of
+        `get_graph_statistics`
+    '''
+
+    filter_funcs = ({'pca': PCA(n_components=2)} if filter_funcs is None
+                    else filter_funcs)
+
+    data_path = parallel.share_array(np.asarray(data))
+    filter_paths = [parallel.share_array(
+        utils.log_transform_2d_filter_values(
+            clone(filter_func).fit_transform(data)))
+        for filter_func in filter_funcs.values()]
+
+    configurations = [(filter_id, filter_name, cover_params, clusterer_params)
+                      for filter_id, filter_name in enumerate(filter_funcs)
+                      for cover_params in ParameterGrid(cover_grid)
+                      for clusterer_params in ParameterGrid(clusterer_grid)]
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_worker,
+                                 initargs=(data_path, filter_paths)) as executor:
+            futures = [executor.submit(
+                _fit_configuration, filter_id,
+                clone(cover).set_params(**cover_params),
+                clone(clusterer).set_params(**clusterer_params),
+                min_component_size)
+                for filter_id, _, cover_params, clusterer_params
+                in configurations]
+            statistics = [f.result() for f in futures]
+    finally:
+        for path in [data_path] + filter_paths:
+            parallel.release_array(path)
+
+    return pd.DataFrame([
+        dict({'filter': filter_name},
+             **{f'cover__{k}': v for k, v in cover_params.items()},
+             **{f'clusterer__{k}': v for k, v in clusterer_params.items()},
+             **stats)
+        for (_, filter_name, cover_params, clusterer_params), stats
+        in zip(configurations, statistics)])
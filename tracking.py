@@ -0,0 +1,289 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import utils
+
+
+def get_fips_by_year(df):
+    '''Function to get the FIPS code of every row of the Mapper input of each
+    election year, in the row order of `utils.split_data_by_year`.
+
+    Parameters
+    ----------
+    df : pandas data frame
+        Data frame of entire data
+
+    Returns
+    -------
+    fips_by_year : dict
+        Dictionary with election year (str) as key and FIPS codes as values
+    '''
+
+    years, fips = df['year'].values, df['fips'].values
+    return dict((str(year), fips[years == year])
+                for year in df['year'].unique())
+
+
+def get_county_membership(node_elements, fips, all_fips):
+    '''Function to build the binary node-by-county membership matrix of a
+    Mapper graph fitted on the counties of one year, with counties numbered
+    in a common order for all years.
+
+    Parameters
+    ----------
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x, or membership matrix from `utils.get_node_membership`
+    fips : ndarray (n_samples)
+        FIPS code of every data point the graph was fitted on
+    all_fips : ndarray
+        Sorted FIPS codes of all counties of all years
+
+    Returns
+    -------
+    membership : scipy.sparse.csr_matrix (n_nodes x n_counties)
+        Membership matrix, entry (i, j) is one if county j is in node i
+    '''
+
+    membership = utils.get_node_membership(node_elements, len(fips))
+    county_ids = np.searchsorted(all_fips, fips)
+    county_membership = sparse.csr_matrix(
+        (np.ones(membership.nnz), county_ids[membership.indices],
+         membership.indptr), shape=(membership.shape[0], len(all_fips)))
+    # a county with several rows in a node counts once
+    county_membership.sum_duplicates()
+    county_membership.data[:] = 1
+
+    return county_membership
+
+
+def get_county_memberships(node_elements_by_year, fips_by_year):
+    '''Function to build the node-by-county membership matrices of the Mapper
+    graphs of all years (see `get_county_membership`).
+
+    Parameters
+    ----------
+    node_elements_by_year : dict
+        Dictionary with election year as key and node elements (or
+        membership matrix) of the graph of that year as values
+    fips_by_year : dict
+        Dictionary with election year as key and FIPS codes of the data
+        points of that year as values, e.g. from `get_fips_by_year`
+
+    Returns
+    -------
+    memberships : dict
+        Dictionary with election year as key and membership matrix
+        (n_nodes x n_counties) as values, in the order of
+        `node_elements_by_year`
+    '''
+
+    all_fips = np.unique(np.concatenate(
+        [np.asarray(fips_by_year[year]) for year in node_elements_by_year]))
+
+    return dict((year, get_county_membership(node_elements,
+                                             np.asarray(fips_by_year[year]),
+                                             all_fips))
+                for year, node_elements in node_elements_by_year.items())
+
+
+def _get_intersections(membership_a, membership_b):
+    # number of counties shared by every pair of nodes of two years, only
+    # for the pairs sharing at least one county
+    intersection = (membership_a @ membership_b.T).tocoo()
+    size_a = np.diff(membership_a.indptr)[intersection.row]
+    size_b = np.diff(membership_b.indptr)[intersection.col]
+    return intersection, size_a, size_b
+
+
+def get_overlap(membership_a, membership_b, metric='jaccard'):
+    '''Function to compute the overlap between every node of a year and every
+    node of another year, from the product of their sparse membership
+    matrices. Pairs of nodes without common county are not stored.
+
+    Parameters
+    ----------
+    membership_a : sparse matrix (n_nodes_a x n_counties)
+        Membership matrix of the first year, from `get_county_membership`
+    membership_b : sparse matrix (n_nodes_b x n_counties)
+        Membership matrix of the second year
+    metric : str (default: 'jaccard')
+        'jaccard' (shared counties over counties in either node), 'overlap'
+        (shared counties over counties in the smaller node) or 'count'
+        (number of shared counties)
+
+    Returns
+    -------
+    overlap : scipy.sparse.csr_matrix (n_nodes_a x n_nodes_b)
+    '''
+
+    intersection, size_a, size_b = _get_intersections(membership_a,
+                                                      membership_b)
+    if metric == 'jaccard':
+        values = intersection.data / (size_a + size_b - intersection.data)
+    elif metric == 'overlap':
+        values = intersection.data / np.minimum(size_a, size_b)
+    elif metric == 'count':
+        values = intersection.data
+    else:
+        raise ValueError(f"Unknown metric '{metric}', use 'jaccard', "
+                         f"'overlap' or 'count'.")
+
+    return sparse.csr_matrix((values, (intersection.row, intersection.col)),
+                             shape=intersection.shape)
+
+
+def get_overlaps(memberships, metric='jaccard'):
+    '''Function to compute the overlap between the nodes of every pair of
+    consecutive years (see `get_overlap`).
+
+    Parameters
+    ----------
+    memberships : dict
+        Dictionary with election year as key and membership matrix as values,
+        in chronological order, from `get_county_memberships`
+    metric : str (default: 'jaccard')
+        'jaccard', 'overlap' or 'count'
+
+    Returns
+    -------
+    overlaps : dict
+        Dictionary with pairs of consecutive years as keys and overlap
+        matrices (n_nodes_a x n_nodes_b) as values
+    '''
+
+    years = list(memberships)
+    return dict(((year_a, year_b),
+                 get_overlap(memberships[year_a], memberships[year_b],
+                             metric))
+                for year_a, year_b in zip(years[:-1], years[1:]))
+
+
+def _get_best_matches(overlap, min_overlap):
+    # column of the largest entry of every row, -1 for rows without entry
+    # above min_overlap
+    best = np.asarray(overlap.argmax(axis=1)).ravel()
+    best_value = overlap.max(axis=1).toarray().ravel()
+    best[best_value <= min_overlap] = -1
+    return best
+
+
+def get_best_match_chains(overlaps, min_overlap=0., mutual=True):
+    '''Function to follow nodes from year to year through their best
+    matches. A node of a year is linked to the node of the next year with
+    which it has the largest overlap; with `mutual`, only if it is also the
+    best match of that node in the previous year, so that chains are
+    disjoint. A chain starts at every node not linked from the previous year.
+
+    Parameters
+    ----------
+    overlaps : dict
+        Dictionary with pairs of consecutive years as keys and overlap
+        matrices as values, from `get_overlaps`
+    min_overlap : float (default: 0.)
+        Overlap a link must exceed
+    mutual : bool (default: True)
+        Boolean to (not) require that linked nodes are the best match of each
+        other
+
+    Returns
+    -------
+    chains : list
+        List of chains, longest first, every chain being a list of
+        (year, node id) tuples in chronological order
+    '''
+
+    pairs = list(overlaps)
+    links, linked = [], []
+    for year_a, year_b in pairs:
+        overlap = overlaps[(year_a, year_b)].tocsr()
+        forward = _get_best_matches(overlap, min_overlap)
+        if mutual:
+            backward = _get_best_matches(overlap.T.tocsr(), min_overlap)
+            has_match = forward >= 0
+            is_mutual = np.zeros(len(forward), dtype=bool)
+            is_mutual[has_match] = (backward[forward[has_match]] ==
+                                    np.flatnonzero(has_match))
+            forward[~is_mutual] = -1
+        links.append(forward)
+        is_linked = np.zeros(overlap.shape[1], dtype=bool)
+        is_linked[forward[forward >= 0]] = True
+        linked.append(is_linked)
+
+    if not pairs:
+        return []
+    years = [pairs[0][0]] + [year_b for _, year_b in pairs]
+    n_nodes = [len(forward) for forward in links] + [len(linked[-1])]
+
+    chains = []
+    for i, year in enumerate(years):
+        starts = (np.arange(n_nodes[i]) if i == 0
+                  else np.flatnonzero(~linked[i - 1]))
+        for node in starts.tolist():
+            chain = [(year, node)]
+            for j in range(i, len(links)):
+                node = int(links[j][node])
+                if node < 0:
+                    break
+                chain.append((years[j + 1], node))
+            chains.append(chain)
+
+    return sorted(chains, key=len, reverse=True)
+
+
+def get_flow_table(memberships, min_counties=1):
+    '''Function to build the table of flows of counties between the nodes of
+    consecutive years, ready for a Sankey diagram: `source` and `target`
+    number the nodes of all years consecutively, in the order of
+    `memberships`, e.g.
+
+        go.Sankey(link=dict(source=flows['source'], target=flows['target'],
+                            value=flows['n_counties']))
+
+    Parameters
+    ----------
+    memberships : dict
+        Dictionary with election year as key and membership matrix as values,
+        in chronological order, from `get_county_memberships`
+    min_counties : int (default: 1)
+        Smallest number of shared counties of a flow
+
+    Returns
+    -------
+    flows : pandas data frame
+        One row per pair of nodes of consecutive years sharing at least
+        `min_counties` counties, with the years, node ids, node numbers
+        (source, target), number of shared counties, Jaccard index and
+        overlap coefficient
+    '''
+
+    years = list(memberships)
+    offsets = np.cumsum([0] + [memberships[year].shape[0]
+                               for year in years])
+    columns = ['source_year', 'source_node', 'target_year', 'target_node',
+               'source', 'target', 'n_counties', 'jaccard', 'overlap']
+
+    tables = []
+    for i, (year_a, year_b) in enumerate(zip(years[:-1], years[1:])):
+        intersection, size_a, size_b = _get_intersections(
+            memberships[year_a], memberships[year_b])
+        n_counties = intersection.data.astype(np.int64)
+        kept = n_counties >= min_counties
+        rows, cols = intersection.row[kept], intersection.col[kept]
+        n_counties = n_counties[kept]
+        size_a, size_b = size_a[kept], size_b[kept]
+        tables.append(pd.DataFrame({
+            'source_year': year_a, 'source_node': rows,
+            'target_year': year_b, 'target_node': cols,
+            'source': offsets[i] + rows, 'target': offsets[i + 1] + cols,
+            'n_counties': n_counties,
+            'jaccard': n_counties / (size_a + size_b - n_counties),
+            'overlap': n_counties / np.minimum(size_a, size_b)},
+            columns=columns))
+
+    if not tables:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(tables, ignore_index=True).sort_values(
+        ['source', 'target'], ignore_index=True)
@@ -1,13 +1,35 @@
+import collections
+import itertools
+
 import numpy as np
+from scipy import sparse
 
 from sklearn.preprocessing import StandardScaler
 
+import instrumentation
+
 import matplotlib.colors
 import pandas as pd
 
 
 def get_reference_layout(figure):
-    return [{c_x: figure._data[idc][c_x] for c_x in ['x', 'y']} for idc, c in enumerate(['lines', 'edges'])]
+    '''Function to get the positions of the edges and nodes of a figure of a
+    mapper graph, to be passed as `keep_layout` to other plots of the graph.
+
+    Parameters
+    ----------
+    figure : plotly figure object
+        Figure of a mapper graph
+
+    Returns
+    -------
+    layout : list
+        List of two dicts with keys 'x' and 'y', for the edge trace and the
+        node trace respectively
+    '''
+
+    return [{c_x: figure.data[idc][c_x] for c_x in ['x', 'y']}
+            for idc in range(2)]
 
 def get_filtered_values(v, indices):
     """Copy v and put NaNs in indices
@@ -120,12 +142,38 @@ def get_cols_for_mapper():
             "Average nonfarm proprietors' income"]
 
 
-def get_data(df):
-    '''Function to extract data for Mapper from data frame.
+def get_float_dtype(x, dtype=None):
+    '''Function to get the floating point type in which to return results
+    computed from an array. Results keep the precision of floating point
+    inputs (e.g. float32), other inputs give float64.
+
+    Parameters
+    ----------
+    x : ndarray
+        Input array
+    dtype : dtype (default: None)
+        Type to use instead of the one of `x`
+
+    Returns
+    -------
+    dtype : numpy dtype
+    '''
+
+    dtype = np.asarray(x).dtype if dtype is None else np.dtype(dtype)
+    return dtype if np.issubdtype(dtype, np.floating) else np.dtype(np.float64)
+
+
+@instrumentation.timed('get_data')
+def get_data(df, dtype=np.float64):
+    '''Function to extract data for Mapper from data frame. The log
+    transformation and the scaling are computed in float64, and only the
+    result is converted to `dtype`.
 
     Parameters
     ----------
     df : pandas data frame
+    dtype : dtype (default: np.float64)
+        Type of the returned data, e.g. np.float32 to halve its memory
 
     Returns
     -------
@@ -136,14 +184,16 @@ def get_data(df):
     data_cols = get_cols_for_mapper()
 
     # perform a log transformation on the data
-    df[data_cols] = (df[data_cols] +
-                     abs(df[data_cols].min().min()) + 1).apply(np.log)
+    values = df[data_cols].values.astype(np.float64)
+    # missing values are ignored by the minimum, as by pandas
+    values = np.log(values + abs(np.nanmin(values)) + 1)
 
     # scale data to have zero mean and a standard deviation of one
     scaler = StandardScaler()
-    df[data_cols] = scaler.fit_transform(df[data_cols])
+    data = scaler.fit_transform(values).astype(dtype, copy=False)
+    df[data_cols] = data
 
-    return df[data_cols].values
+    return data
 
 
 def split_data_by_year(data, df):
@@ -169,13 +219,105 @@ def split_data_by_year(data, df):
                         df['year'].unique()))))
 
 
-def log_transform_2d_filter_values(x):
-    '''Transformation of PCA values to obtain final filter.
+ElectionData = collections.namedtuple(
+    'ElectionData', ['years', 'n_counties', 'winner', 'n_electors',
+                     'republican', 'democrat', 'total_votes'])
+
+
+def get_election_data(df):
+    '''Function to gather the election columns into dense year x county
+    arrays. Row i of a year is the i-th county of that year in `df`, which is
+    the row order of the Mapper input returned by `split_data_by_year`. Years
+    with fewer counties are padded with zeros.
+
+    Parameters
+    ----------
+    df : pandas data frame
+        Data frame containing the election columns and the year of election
+
+    Returns
+    -------
+    election_data : ElectionData
+        Named tuple of the sorted election years, the number of counties per
+        year and one array (n_years x n_counties) per election column
+    '''
+
+    years, year_idx = np.unique(df['year'].values, return_inverse=True)
+    county_idx = df.groupby('year').cumcount().values
+    n_counties = np.bincount(year_idx, minlength=len(years))
+
+    cube = {}
+    for col in ElectionData._fields[2:]:
+        cube[col] = np.zeros((len(years), n_counties.max()))
+        cube[col][year_idx, county_idx] = df[col].values
+
+    return ElectionData(years=years, n_counties=n_counties, **cube)
+
+
+def get_election_values(election_data, year, col):
+    '''Function to get the values of an election column for a given year.
+
+    Parameters
+    ----------
+    election_data : ElectionData
+        Output of `get_election_data`
+    year : int or str
+        Election year
+    col : str
+        Election column (e.g. 'n_electors')
+
+    Returns
+    -------
+    values : ndarray (n_counties)
+        Values of `col` for the counties of `year`
+    '''
+
+    i = np.searchsorted(election_data.years, int(year))
+    if i == len(election_data.years) or election_data.years[i] != int(year):
+        raise ValueError(f'No election data for year {year}.')
+
+    return getattr(election_data, col)[i, :election_data.n_counties[i]]
+
+
+def get_electors_won(node_elements, election_data, year):
+    '''Function to calculate the percentage of electors won by the
+    republicans in each node
+
+    Parameters
+    ----------
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x, or membership matrix from `get_node_membership`
+    election_data : ElectionData
+        Output of `get_election_data`
+    year : int or str
+        Election year
+
+    Returns
+    -------
+    electors_won : ndarray
+        Array of percentage of electors of a node won by republicans
+    '''
+
+    n_electors = get_election_values(election_data, year, 'n_electors')
+    winner = get_election_values(election_data, year, 'winner')
+    membership = get_node_membership(node_elements, n_electors.shape[0])
+
+    return (100 * (membership @ (winner * n_electors)) /
+            (membership @ n_electors))
+
+
+def log_transform_2d_filter_values(x, min_value=None):
+    '''Transformation of PCA values to obtain final filter. `x` is not
+    modified.
 
     Parameters
     ----------
     x : ndarray (n_shape x n_dim)
-        Filter values
+        Filter values (float32 values stay float32)
+    min_value : float (default: None)
+        Value of the first filter mapped to 0. If None, the minimum of
+        `x[:, 0]` is used. Smaller values are also mapped to 0
 
     Returns
     -------
@@ -183,9 +325,49 @@ def log_transform_2d_filter_values(x):
         Transformed PCA
     '''
 
-    x[:, 0] = np.log(x[:, 0] - min(x[:, 0]) + 1)
-    x[:, 1] = np.log(np.abs(x[:, 1]) + 1)
-    return x
+    x_transformed = np.array(x, dtype=get_float_dtype(x))
+    min_value = x_transformed[:, 0].min() if min_value is None else min_value
+    x_transformed[:, 0] = np.log(
+        np.maximum(x_transformed[:, 0] - min_value, 0) + 1)
+    x_transformed[:, 1] = np.log(np.abs(x_transformed[:, 1]) + 1)
+    return x_transformed
+
+
+def get_node_membership(node_elements, n_samples=None):
+    '''Function to build the sparse node-by-sample membership matrix of a
+    Mapper graph. Entry (i, j) is one if data point j belongs to node i.
+
+    Parameters
+    ----------
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x (e.g. graph['node_metadata']['node_elements']). A sparse
+        matrix is returned as CSR without rebuilding it.
+    n_samples : int (default: None)
+        Number of data points the Mapper graph was built on. If None, it is
+        inferred from the largest data point id.
+
+    Returns
+    -------
+    membership : scipy.sparse.csr_matrix (n_nodes x n_samples)
+        Membership matrix
+    '''
+
+    if sparse.issparse(node_elements):
+        return node_elements.tocsr()
+
+    node_size = np.fromiter(map(len, node_elements), dtype=np.int64,
+                            count=len(node_elements))
+    indptr = np.concatenate([[0], np.cumsum(node_size)])
+    indices = (np.concatenate([np.asarray(x, dtype=np.int64)
+                               for x in node_elements])
+               if indptr[-1] else np.zeros(0, dtype=np.int64))
+
+    if n_samples is None:
+        n_samples = int(indices.max()) + 1 if indices.size else 0
+
+    return sparse.csr_matrix((np.ones(indices.size), indices, indptr),
+                             shape=(len(node_size), n_samples))
 
 
 def get_node_size(node_elements):
@@ -193,27 +375,30 @@ def get_node_size(node_elements):
 
     Parameters
     ----------
-    node_elements: tuple
+    node_elements: tuple or sparse matrix
         Tuple of arrays where array at positin x contains the data points for
-        node x
+        node x, or membership matrix from `get_node_membership`
 
     Returns
     -------
-    node_size : list
-        List of node sizes
+    node_size : ndarray
+        Array of node sizes
     '''
 
-    return list(map(len, node_elements))
+    return np.diff(get_node_membership(node_elements).indptr)
 
 
 def get_node_summary(node_elements, data, summary_stat=np.mean):
-    '''Function to calculate a summary statistic per node
+    '''Function to calculate a summary statistic per node. The mean is
+    computed for all nodes at once as a sparse matrix product, any other
+    statistic is applied node by node. The sums of the mean are accumulated
+    in float64, and returned in the precision of `data` (e.g. float32).
 
     Parameters
     ----------
-    node_elements : tuple
+    node_elements : tuple or sparse matrix
         Tuple of arrays where array at positin x contains the data points for
-        node x
+        node x, or membership matrix from `get_node_membership`
     data: ndarray
         Data to be used
     summary_stat : function
@@ -221,12 +406,144 @@ def get_node_summary(node_elements, data, summary_stat=np.mean):
 
     Returns
     -------
-    node_summary : list
-        List of summary statistics
+    node_summary : ndarray
+        Array of summary statistics
     '''
 
-    return list(map(lambda x: summary_stat(data[x]),
-                    node_elements))
+    data = np.asarray(data)
+    membership = get_node_membership(node_elements, data.shape[0])
+
+    if summary_stat is np.mean:
+        node_size = get_node_size(membership)
+        if data.ndim > 1:
+            node_size = node_size[:, None]
+        # the membership matrix is float64, so the product is too
+        return ((membership @ data) / node_size).astype(
+            get_float_dtype(data), copy=False)
+
+    if data.ndim == 1 and summary_stat in _SEGMENT_STATISTICS:
+        return get_node_summaries(membership, data[:, None],
+                                  [_SEGMENT_STATISTICS[summary_stat]]
+                                  ).values[:, 0]
+
+    return np.array([summary_stat(data[membership.indices[start:stop]])
+                     for start, stop in zip(membership.indptr[:-1],
+                                            membership.indptr[1:])])
+
+
+# numpy functions computed by `get_node_summaries`
+_SEGMENT_STATISTICS = {np.median: 'median', np.std: 'std', np.min: 'min',
+                       np.max: 'max', np.sum: 'sum'}
+
+
+def _reduce_segments(ufunc, values, indptr):
+    # ufunc.reduceat over the rows of every non-empty segment (reduceat
+    # returns a row of the next segment for empty ones)
+    result = np.full((len(indptr) - 1, values.shape[1]), np.nan)
+    non_empty = np.flatnonzero(np.diff(indptr))
+    if non_empty.size:
+        result[non_empty] = ufunc.reduceat(values, indptr[non_empty], axis=0)
+    return result
+
+
+def get_node_summaries(node_elements, data,
+                       statistics=('mean', 'median', 'std'), columns=None):
+    '''Function to calculate many summary statistics of many columns for all
+    nodes at once. The data points of the nodes are gathered once into a
+    flat array ordered by node (the CSR layout of the membership matrix), so
+    that sums, extrema and moments are segmented reductions
+    (`ufunc.reduceat`) over all columns, and quantiles are read from the
+    segments after sorting all columns by node and value at once. Statistics
+    are computed in float64.
+
+    Parameters
+    ----------
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x, or membership matrix from `get_node_membership`
+    data : ndarray or pandas data frame (n_samples x n_columns)
+        Data to be used
+    statistics : list (default: ('mean', 'median', 'std'))
+        Statistics among 'mean', 'median', 'std', 'min', 'max', 'sum' and
+        'size', and quantiles given as floats between 0 and 1 (computed with
+        linear interpolation, like np.quantile)
+    columns : list (default: None)
+        Names of the columns of `data`. If None, the columns of the data
+        frame, or the column numbers, are used
+
+    Returns
+    -------
+    node_summaries : pandas data frame (n_nodes x (n_columns * n_statistics))
+        Table with one row per node, and one column per pair of data column
+        and statistic (a two-level column index)
+    '''
+
+    if columns is None:
+        columns = (list(data.columns) if isinstance(data, pd.DataFrame)
+                   else list(range(np.shape(data)[1])))
+    data = np.asarray(data)
+    membership = get_node_membership(node_elements, data.shape[0])
+    indptr = membership.indptr
+
+    values = data[membership.indices].astype(np.float64)
+    node_size = np.diff(indptr)
+    node_ids = np.repeat(np.arange(len(node_size)), node_size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = _reduce_segments(np.add, values, indptr) / node_size[:, None]
+
+    sorted_values = None
+    results = {}
+    for statistic in statistics:
+        if statistic == 'mean':
+            result = mean
+        elif statistic == 'sum':
+            result = _reduce_segments(np.add, values, indptr)
+        elif statistic == 'size':
+            result = np.repeat(node_size[:, None].astype(float),
+                               values.shape[1], axis=1)
+        elif statistic == 'std':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = np.sqrt(_reduce_segments(
+                    np.add, (values - mean[node_ids]) ** 2, indptr) /
+                    node_size[:, None])
+        elif statistic == 'min':
+            result = _reduce_segments(np.minimum, values, indptr)
+        elif statistic == 'max':
+            result = _reduce_segments(np.maximum, values, indptr)
+        else:
+            q = .5 if statistic == 'median' else float(statistic)
+            if sorted_values is None:
+                # sort every column by node, then by value: the data is
+                # sorted once, and the values of the nodes are sorted by the
+                # integer keys node id x n_samples + rank of the value
+                order = np.argsort(data, axis=0)
+                rank = np.empty_like(order)
+                np.put_along_axis(rank, order, np.repeat(
+                    np.arange(data.shape[0])[:, None], data.shape[1],
+                    axis=1), axis=0)
+                keys = np.sort(node_ids[:, None] * data.shape[0] +
+                               rank[membership.indices], axis=0)
+                sorted_values = np.take_along_axis(
+                    np.take_along_axis(data, order, axis=0),
+                    keys % data.shape[0], axis=0).astype(np.float64)
+            position = q * (node_size - 1).clip(0)
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            weight = (position - low)[:, None]
+            start = indptr[:-1]
+            with np.errstate(invalid='ignore'):
+                result = ((1 - weight) * sorted_values[(start + low).clip(
+                    0, max(len(values) - 1, 0))] +
+                    weight * sorted_values[(start + high).clip(
+                        0, max(len(values) - 1, 0))])
+            result[node_size == 0] = np.nan
+        results[statistic] = result
+
+    table = np.stack([results[statistic] for statistic in statistics],
+                     axis=2).reshape(len(node_size), -1)
+    return pd.DataFrame(table, columns=pd.MultiIndex.from_product(
+        [columns, list(statistics)], names=['column', 'statistic']))
 
 
 def get_n_electors(node_elements, n_electors):
@@ -234,21 +551,23 @@ def get_n_electors(node_elements, n_electors):
 
     Parameters
     ----------
-    node_elements : tuple
+    node_elements : tuple or sparse matrix
         Tuple of arrays where array at positin x contains the data points for
-        node x
+        node x, or membership matrix from `get_node_membership`
     n_electors : pandas series
         Pandas series of number of weighted electors per county
 
     Returns
     -------
-    n_electors : list
-        List of percentage of electors within a node(w.r.t to total number of
+    n_electors : ndarray
+        Array of percentage of electors within a node(w.r.t to total number of
         electors)
     '''
 
-    return [100 * n_electors.iloc[x].sum() / n_electors.sum()
-            for x in node_elements]
+    n_electors = np.asarray(n_electors, dtype=float)
+    membership = get_node_membership(node_elements, n_electors.shape[0])
+
+    return 100 * (membership @ n_electors) / n_electors.sum()
 
 
 def get_node_text(node_elements, n_electors, node_color, label):
@@ -281,8 +600,62 @@ def get_node_text(node_elements, n_electors, node_color, label):
             for x, y, z in zip(node_elements.items(), n_electors, node_color)]
 
 
+def get_node_customdata(node_elements, n_electors, node_color):
+    '''Function to gather the values shown in the node labels of
+    `get_node_text` into one compact array, to be rendered by the browser
+    with the template of `get_node_hovertemplate`.
+
+    Parameters
+    ----------
+    node_elements : tuple or sparse matrix
+        Tuple of arrays where array at positin x contains the data points for
+        node x, or membership matrix from `get_node_membership`
+    n_electors : ndarray
+        Percentage of electors of every node (see `get_n_electors`)
+    node_color : ndarray
+        Value shown as mean of the label of every node
+
+    Returns
+    -------
+    customdata : ndarray (n_nodes x 4)
+        float32 array of node sizes, percentages of electors, percentages of
+        electors per county and node colors
+    '''
+
+    node_size = get_node_size(node_elements)
+    n_electors = np.asarray(n_electors, dtype=np.float64)
+
+    return np.stack([node_size, n_electors, n_electors / node_size,
+                     np.asarray(node_color, dtype=np.float64)],
+                    axis=1).astype(np.float32)
+
+
+def get_node_hovertemplate(label):
+    '''Function to create the template of the node labels of
+    `get_node_text`, filled in by the browser from the node id and the array
+    of `get_node_customdata`.
+
+    Parameters
+    ----------
+    label: str
+        Name of label (e.g. 'income')
+
+    Returns
+    -------
+    hovertemplate : str
+    '''
+
+    return ('Node Id: %{pointNumber}<br>'
+            'Node size: %{customdata[0]}<br>'
+            'Percentage of Weighted Electors: %{customdata[1]:.2f}<br>'
+            'Percentage of Weighted Electors per County: '
+            '%{customdata[2]:.3f}<br>'
+            f'Mean {label}: %{{customdata[3]}}<extra></extra>')
+
+
 def get_subgraph(graph, vertices_to_remove):
-    '''Extract a subgraph out of a given one.
+    '''Extract a subgraph out of a given one. The graph is copied; see
+    `subgraph.get_subgraph_view` for a view without copy.
 
     Parameters
     ----------
@@ -304,41 +677,48 @@ def get_subgraph(graph, vertices_to_remove):
 
 
 def get_county_plot_data(graph, df, col, cmap):
-    '''Function to create data for a plot of a map of the US.
+    '''Function to create data for a plot of a map of the US. Each county is
+    colored by the mean over the summaries of the nodes it belongs to.
 
     Parameters
     ----------
     graph : igraph object
     df : pandas data frame
-    col : str
-        Column to base color of map on
+    col : str or list
+        Column (or list of columns) to base color of map on
     cmap : colormap
 
     Returns
     -------
-    data : tuple
+    data : tuple or dict
         Tuple of list of color of a node (numerical value) and list of
-        colors to use
+        colors to use. If `col` is a list, dictionary with the columns as keys
+        and such tuples as values
     '''
 
-    map_col = (pd.DataFrame(np.zeros((df.shape[0],
-                                      2)),
-                            columns=['color_sum', 'n_counties'])
-               .astype({'n_counties': 'int'}))
+    cols = [col] if isinstance(col, str) else list(col)
 
-    for rows, val in zip(graph['node_metadata']['node_elements'],
-                         get_node_summary(graph['node_metadata']
-                                          ['node_elements'],
-                                          df[col])):
-        map_col.loc[rows] = map_col.loc[rows] + [val, 1]
+    membership = get_node_membership(graph['node_metadata']['node_elements'],
+                                     df.shape[0])
+    values = df[cols].values
+    node_summary = get_node_summary(
+        membership, values.astype(get_float_dtype(values), copy=False))
 
-    colors = list(map(matplotlib.colors.rgb2hex,
-                      cmap((map_col['color_sum'] /
-                            map_col['n_counties']).sort_values().unique()
-                           .tolist())[:, :3]))
+    # sum the node summaries and count the nodes of every county
+    color_sum = membership.T @ node_summary
+    n_nodes = np.bincount(membership.indices, minlength=df.shape[0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        county_color = (color_sum / n_nodes[:, None]).astype(
+            node_summary.dtype, copy=False)
 
-    return ((map_col['color_sum'] / map_col['n_counties']).tolist(),
-            colors)
+    data = {}
+    for i, c in enumerate(cols):
+        colors = list(map(matplotlib.colors.rgb2hex,
+                          cmap(np.unique(county_color[:, i]).tolist())
+                          [:, :3]))
+        data[c] = (county_color[:, i].tolist(), colors)
+
+    return data[col] if isinstance(col, str) else data
 
 
 def get_regions():
@@ -364,6 +744,34 @@ def get_regions():
     }
 
 
+def get_region_nodes(regions, n_nodes):
+    '''Function to build the sparse region-by-node indicator matrix of
+    regions of a Mapper graph. Entry (i, j) is one if node j belongs to the
+    i-th region of `regions`.
+
+    Parameters
+    ----------
+    regions : dict
+        Dictionary of regions with ids as keys and set of nodes as values
+    n_nodes : int
+        Number of nodes of the Mapper graph
+
+    Returns
+    -------
+    region_nodes : scipy.sparse.csr_matrix (n_regions x n_nodes)
+        Indicator matrix, with one row per region in the order of `regions`
+    '''
+
+    region_size = np.fromiter(map(len, regions.values()), dtype=np.int64,
+                              count=len(regions))
+    rows = np.repeat(np.arange(len(regions)), region_size)
+    cols = np.fromiter(itertools.chain.from_iterable(regions.values()),
+                       dtype=np.int64, count=region_size.sum())
+
+    return sparse.csr_matrix((np.ones(len(cols)), (rows, cols)),
+                             shape=(len(regions), n_nodes))
+
+
 def get_data_per_region(regions, node_elements):
     '''Function to assign to each region the data points enclosed in it.
 
@@ -371,9 +779,9 @@ def get_data_per_region(regions, node_elements):
     ----------
     regions : dict
         Dictionary of regions with ids as keys and set of nodes as values
-    node_elements: tuple
+    node_elements: tuple or sparse matrix
         Tuple of arrays where array at positin x contains the data points for
-        node x
+        node x, or membership matrix from `get_node_membership`
 
     Returns
     -------
@@ -382,11 +790,20 @@ def get_data_per_region(regions, node_elements):
             as values
     '''
 
-    # create tuples of region id with corresponding data points. The latter are
-    # found by taking the union of all elements belonging to a region.
-    return dict((region_id, set.union(*[set(node_elements[node])
-                                        for node in regions[region_id]]))
-                for region_id in regions.keys())
+    membership = get_node_membership(node_elements)
+    region_ids = list(regions.keys())
+
+    # build a region-by-node indicator matrix; its product with the
+    # membership matrix counts, for every region, the nodes containing each
+    # data point. The data points of a region are its non-zero columns.
+    region_nodes = get_region_nodes(regions, membership.shape[0])
+    region_points = (region_nodes @ membership).tocsr()
+
+    return dict((region_id,
+                 set(region_points.indices[region_points.indptr[i]:
+                                           region_points.indptr[i + 1]]
+                     .tolist()))
+                for i, region_id in enumerate(region_ids))
 
 
 def hex2rgb(hex_colors):